@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 
 class ChatRequest(BaseModel):
@@ -17,6 +17,7 @@ class ChatResponse(BaseModel):
     session_id: str
     reply: str
     tool_result: Optional[Dict[str, Any]] = None
+    tool_results: Optional[List[Dict[str, Any]]] = None
     desktop_tools_enabled: bool
     client_action: Optional[Dict[str, Any]] = None
 
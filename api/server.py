@@ -1,4 +1,5 @@
 from fastapi import APIRouter, FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
 from openai import OpenAI
 
 from api.schemas import (
@@ -10,9 +11,16 @@ from api.schemas import (
 )
 from assistant.service import AssistantService
 from audio.tts import synthesize_speech
-from llm.ollama import LLMUnavailableError
+from llm.ollama import LLMOverloadedError, LLMUnavailableError, get_pool
+from config import WEATHER_PREFETCH
+from net.breaker import OPEN, breaker_states
+from net.clients import close_async_clients, pool_stats
+from tools.executor import tool_stats
+from tools.weather import start_forecast_prefetch
+from tools.web_search import search_cache_stats
 from memory.user_memory import clear_memory, delete_memory_entry, list_memory_entries, update_memory_entry
 
+import json
 import tempfile
 
 client = OpenAI()
@@ -30,7 +38,16 @@ assistant = AssistantService(enable_desktop_tools=False)
 
 @app.get('/health')
 def healthcheck():
-    return {'status': 'ok'}
+    """
+    Estado do servidor e dos servicos de que depende.
+
+    Mostra o estado (em cache) dos circuit breakers: com algum aberto o
+    status passa a "degraded" e os pedidos a esse servico falham de imediato.
+    """
+    get_pool()
+    dependencies = breaker_states()
+    degraded = any(state['state'] == OPEN for state in dependencies.values())
+    return {'status': 'degraded' if degraded else 'ok', 'dependencies': dependencies}
 
 
 @app.post('/sessions', response_model=SessionResponse)
@@ -46,18 +63,100 @@ def delete_session(session_id: str):
     return {'deleted': True}
 
 
+@app.get('/metrics')
+def metrics():
+    return {
+        'http': pool_stats(),
+        'llm': get_pool().stats(),
+        'sessions': assistant.sessions.stats(),
+        'response_cache': assistant.response_cache.stats() if assistant.response_cache else None,
+        'search_cache': search_cache_stats(),
+        'tools': tool_stats(),
+    }
+
+
+@app.on_event('startup')
+def start_background_jobs():
+    if WEATHER_PREFETCH:
+        start_forecast_prefetch()
+
+
+@app.on_event('shutdown')
+async def close_http_clients():
+    await close_async_clients()
+
+
 @app.post('/chat', response_model=ChatResponse)
-def chat(payload: ChatRequest):
+async def chat(payload: ChatRequest):
     try:
-        return assistant.chat(payload.session_id, payload.message)
+        return await assistant.achat(payload.session_id, payload.message)
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc)) from exc
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except LLMOverloadedError as exc:
+        raise _overloaded(exc) from exc
     except LLMUnavailableError as exc:
         raise HTTPException(status_code=503, detail=str(exc)) from exc
 
 
+def _overloaded(exc: LLMOverloadedError) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(exc), headers={'Retry-After': str(exc.retry_after)})
+
+
+@app.post('/chat/stream')
+async def chat_stream(payload: ChatRequest):
+    """
+    Chat em Server-Sent Events.
+
+    Envia eventos "delta" com os tokens da resposta e um evento "done" com o
+    mesmo conteudo de /chat (incluindo tool_result e client_action).
+
+    O primeiro evento e obtido antes de responder, para que um Ollama
+    sobrecarregado devolva 503 com Retry-After em vez de um stream vazio.
+    """
+    try:
+        events = assistant.stream_chat(payload.session_id, payload.message)
+        first = await events.__anext__()
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except LLMOverloadedError as exc:
+        raise _overloaded(exc) from exc
+    except LLMUnavailableError as exc:
+        raise HTTPException(status_code=503, detail=str(exc)) from exc
+
+    return StreamingResponse(
+        _sse_events(first, events),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def _sse(event_type: str, data) -> str:
+    return f'event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+async def _sse_events(first, events):
+    yield _sse(first['type'], first['data'])
+
+    try:
+        async for event in events:
+            yield _sse(event['type'], event['data'])
+    except KeyError as exc:
+        yield _sse('error', {'status': 404, 'detail': str(exc)})
+    except LLMOverloadedError as exc:
+        yield _sse('error', {'status': 503, 'detail': str(exc), 'retry_after': exc.retry_after})
+    except LLMUnavailableError as exc:
+        yield _sse('error', {'status': 503, 'detail': str(exc)})
+    except Exception as exc:
+        # Os cabecalhos (200) ja foram enviados: o cliente recebe sempre um
+        # evento final, em vez de um stream cortado sem "done" nem "error".
+        print(f'Erro no stream de chat: {exc!r}')
+        yield _sse('error', {'status': 500, 'detail': 'Erro interno ao gerar a resposta.'})
+
+
 @app.get('/memory', response_model=list[MemoryEntryResponse])
 def get_memory_entries():
     return list_memory_entries()
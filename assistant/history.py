@@ -0,0 +1,87 @@
+"""
+Gestao do historico de conversa por orcamento de tokens.
+
+O historico e dividido em turnos: cada turno comeca numa mensagem do
+utilizador e inclui as respostas do assistente e os resultados de tools
+que se seguem. Os turnos sao descartados inteiros, por isso um tool call
+nunca fica separado do seu resultado.
+"""
+
+from config import HISTORY_TOKEN_BUDGET, HISTORY_TRIM_BLOCK
+from llm.tokens import estimate_message_tokens, estimate_tokens, truncate_to_tokens
+
+# Nunca cortar o resultado de uma tool abaixo deste numero de tokens
+MIN_TOOL_RESULT_TOKENS = 64
+
+
+def split_turns(messages: list) -> list[list[dict]]:
+    """Agrupa mensagens (sem o system prompt) em turnos."""
+    turns = []
+
+    for message in messages:
+        if message.get("role") == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+
+    return turns
+
+
+def history_tokens(messages: list) -> int:
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def trim_history(messages: list, budget: int = HISTORY_TOKEN_BUDGET, block_turns: int = HISTORY_TRIM_BLOCK) -> None:
+    """
+    Garante que o historico cabe em budget tokens, alterando messages.
+
+    O system prompt e o turno mais recente ficam sempre. Os turnos antigos
+    sao descartados em blocos de block_turns, para que o inicio da conversa
+    fique igual durante varios turnos e o Ollama reutilize a cache KV. Se o
+    turno atual sozinho nao couber, os resultados de tools sao encurtados.
+    """
+    if not messages:
+        return
+
+    used = history_tokens(messages)
+    if used <= budget:
+        return
+
+    head = messages[:1] if messages[0].get("role") == "system" else []
+    turns = split_turns(messages[len(head):])
+    sizes = [history_tokens(turn) for turn in turns]
+    dropped = 0
+
+    while used > budget and dropped < len(turns) - 1:
+        for _ in range(block_turns):
+            if dropped >= len(turns) - 1:
+                break
+            used -= sizes[dropped]
+            dropped += 1
+
+    kept = [message for turn in turns[dropped:] for message in turn]
+
+    if used > budget:
+        _shrink_tool_results(kept, used - budget)
+
+    messages[:] = head + kept
+
+
+def _shrink_tool_results(messages: list, excess: int) -> None:
+    tool_messages = sorted(
+        (message for message in messages if message.get("role") == "tool"),
+        key=lambda message: estimate_tokens(message.get("content") or ""),
+        reverse=True,
+    )
+
+    for message in tool_messages:
+        if excess <= 0:
+            return
+
+        content = message.get("content") or ""
+        tokens = estimate_tokens(content)
+        limit = max(tokens - excess, MIN_TOOL_RESULT_TOKENS)
+
+        if limit < tokens:
+            message["content"] = truncate_to_tokens(content, limit)
+            excess -= tokens - limit
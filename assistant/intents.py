@@ -0,0 +1,129 @@
+"""
+Encaminhamento de intencoes rapidas (fast paths) antes do LLM.
+
+Cada intencao declara grupos de palavras-chave: a intencao aplica-se quando
+cada grupo tem pelo menos uma palavra presente na mensagem normalizada.
+Opcionalmente pode ter um padrao regex, avaliado apenas quando as
+palavras-chave ja coincidem (ex: "remover preferencia 2").
+
+Todas as palavras-chave ficam compiladas numa unica regex, por isso
+encaminhar uma mensagem custa uma passagem pelo texto,
+independentemente do numero de intencoes registadas.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class Intent:
+    name: str
+    groups: tuple[frozenset[str], ...]
+    handler: Callable
+    pattern: re.Pattern | None = None
+
+
+@dataclass(frozen=True)
+class IntentMatch:
+    intent: Intent
+    match: re.Match | None
+
+    @property
+    def name(self) -> str:
+        return self.intent.name
+
+    @property
+    def handler(self) -> Callable:
+        return self.intent.handler
+
+
+class IntentRouter:
+    """Registo de intencoes com um matcher compilado uma unica vez."""
+
+    def __init__(self):
+        self._intents: list[Intent] = []
+        self._scanner: re.Pattern | None = None
+        self._implied: dict[str, frozenset[str]] = {}
+
+    @property
+    def intents(self) -> list[Intent]:
+        return list(self._intents)
+
+    def register(self, name: str, *groups, pattern: str | None = None):
+        """
+        Decorator que regista um handler para uma intencao.
+
+        Cada argumento em groups e uma string ou uma lista de strings
+        (alternativas). A ordem de registo define a prioridade.
+
+            @router.register("volume_up", "volume", ["aumenta", "subir"])
+            def volume_up(service, session_id, messages, user_message, msg, match):
+                ...
+        """
+        if not groups:
+            raise ValueError("Uma intencao precisa de pelo menos uma palavra-chave.")
+
+        normalized_groups = tuple(
+            frozenset([group] if isinstance(group, str) else group)
+            for group in groups
+        )
+        compiled = re.compile(pattern) if pattern else None
+
+        def decorator(handler):
+            self._intents.append(Intent(name, normalized_groups, handler, compiled))
+            self._scanner = None
+            return handler
+
+        return decorator
+
+    def _compile(self):
+        keywords = sorted(
+            {keyword for intent in self._intents for group in intent.groups for keyword in group},
+            key=len,
+            reverse=True,
+        )
+
+        # O lookahead encontra, em cada posicao, a palavra-chave mais longa
+        # que ai comeca; as mais curtas contidas nela ficam implicitas.
+        self._scanner = re.compile("(?=(" + "|".join(re.escape(k) for k in keywords) + "))")
+        self._implied = {
+            keyword: frozenset(other for other in keywords if other in keyword)
+            for keyword in keywords
+        }
+
+    def scan(self, msg: str) -> set[str]:
+        """Devolve as palavras-chave presentes na mensagem normalizada."""
+        if self._scanner is None:
+            self._compile()
+
+        found = set()
+        for match in self._scanner.finditer(msg):
+            keyword = match.group(1)
+            if keyword not in found:
+                found |= self._implied[keyword]
+        return found
+
+    def route(self, msg: str) -> IntentMatch | None:
+        """Devolve a primeira intencao (por prioridade) que se aplica a msg."""
+        if not self._intents:
+            return None
+
+        found = self.scan(msg)
+        if not found:
+            return None
+
+        for intent in self._intents:
+            if not all(group & found for group in intent.groups):
+                continue
+
+            if intent.pattern is None:
+                return IntentMatch(intent, None)
+
+            match = intent.pattern.search(msg)
+            if match:
+                return IntentMatch(intent, match)
+
+        return None
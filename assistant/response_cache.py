@@ -0,0 +1,211 @@
+"""
+Cache de respostas do LLM para perguntas sem contexto.
+
+Perguntas como "conta uma piada" ou "o que e a fotossintese" repetem-se
+muito e nao dependem da conversa anterior. A primeira resposta do modelo
+fica guardada com uma chave feita a partir da pergunta normalizada, do
+system prompt (que muda quando a memoria ou as tools mudam) e do modelo.
+
+As entradas mais usadas ficam em memoria (LRU); todas ficam tambem em
+SQLite para sobreviverem a reinicios e serem partilhadas entre workers.
+aget/aput so passam pelo SQLite numa thread, fora do event loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from config import (
+    MODEL,
+    RESPONSE_CACHE_DB,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_REPLY_CHARS,
+    RESPONSE_CACHE_TTL,
+)
+
+
+def cache_key(normalized_message: str, system_prompt: str, model: str = MODEL) -> str:
+    """Chave da pergunta; ignora espacos repetidos e pontuacao final."""
+    question = " ".join(normalized_message.split()).rstrip(" ?!.")
+    material = "\0".join((model, system_prompt, question))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU em memoria com TTL, persistido em SQLite."""
+
+    # Limpeza das entradas expiradas/excedentes no SQLite a cada N escritas
+    PURGE_EVERY = 100
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_DB,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_reply_chars: int = RESPONSE_CACHE_MAX_REPLY_CHARS,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_reply_chars = max_reply_chars
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._writes = 0
+        self._lock = Lock()
+        # Uma ligacao por thread, aberta no primeiro uso e reutilizada
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """
+        )
+        conn.commit()
+
+    def _connect(self):
+        """Ligacao SQLite da thread atual (WAL, synchronous=NORMAL)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5, cached_statements=32)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> str | None:
+        reply = self._get_resident(key)
+        if reply is not None:
+            return reply
+        return self._get_stored(key)
+
+    async def aget(self, key: str) -> str | None:
+        """Versao assincrona de get."""
+        reply = self._get_resident(key)
+        if reply is not None:
+            return reply
+        return await asyncio.to_thread(self._get_stored, key)
+
+    def _get_resident(self, key: str) -> str | None:
+        now = time.time()
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and now - cached[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+
+        return None
+
+    def _get_stored(self, key: str) -> str | None:
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT reply, created_at FROM responses WHERE key = ? AND created_at >= ?",
+            (key, now - self.ttl),
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+
+        with self._lock:
+            if row is None:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._remember_locked(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, reply: str) -> None:
+        stored = self._put_resident(key, reply)
+        if stored is not None:
+            self._put_stored(key, reply, *stored)
+
+    async def aput(self, key: str, reply: str) -> None:
+        """Versao assincrona de put."""
+        stored = self._put_resident(key, reply)
+        if stored is not None:
+            await asyncio.to_thread(self._put_stored, key, reply, *stored)
+
+    def _put_resident(self, key: str, reply: str):
+        """Guarda em memoria; devolve (instante, limpar SQLite) ou None se nao for guardavel."""
+        if not reply or len(reply) > self.max_reply_chars:
+            return None
+
+        now = time.time()
+
+        with self._lock:
+            self._remember_locked(key, reply, now)
+            self._writes += 1
+            return now, self._writes % self.PURGE_EVERY == 0
+
+    def _put_stored(self, key: str, reply: str, now: float, purge: bool) -> None:
+        conn = self._connect()
+        conn.execute(
+            """
+            INSERT INTO responses (key, reply, created_at, last_used) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                reply = excluded.reply,
+                created_at = excluded.created_at,
+                last_used = excluded.last_used
+        """,
+            (key, reply, now, now),
+        )
+        if purge:
+            self._purge(conn, now)
+        conn.commit()
+
+    def _remember_locked(self, key: str, reply: str, created_at: float) -> None:
+        self._entries[key] = (reply, created_at)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _purge(self, conn, now: float) -> None:
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        conn.execute(
+            """
+            DELETE FROM responses WHERE key NOT IN (
+                SELECT key FROM responses ORDER BY last_used DESC LIMIT ?
+            )
+        """,
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+        conn = self._connect()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "resident_entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+            }
@@ -2,22 +2,37 @@
 
 from __future__ import annotations
 
+import inspect
 import json
-import sqlite3
+import time
 import unicodedata
 from datetime import datetime
-from threading import Lock
 from uuid import uuid4
 
-from config import MAX_TURNS, DB_FILE
-from llm.ollama import call_llm
+from assistant.history import trim_history
+from assistant.intents import IntentRouter
+from assistant.response_cache import ResponseCache, cache_key
+from assistant.sessions import SessionStore
+from config import MEMORY_RETRIEVAL, MEMORY_TOP_K, OLLAMA_NATIVE_TOOLS, RESPONSE_CACHE_ENABLED
+from llm.ollama import acall_llm, astream_llm, call_llm
 from memory.extract import extract_user_facts
-from memory.user_memory import init_db, load_facts, delete_preference, delete_reminder
-from prompts.system_prompt import build_system_prompt
-from tools.executor import execute_tool, extract_tool_call, parse_day
-from tools.registry import TOOLS
-from tools.weather import CITY_COORDS
+from memory.user_memory import clear_memory, init_db, load_facts, delete_preference, delete_reminder
+from memory.vectors import arelevant_memories, relevant_memories
+from prompts.system_prompt import build_memory_context, build_system_prompt
+from tools.executor import (
+    StreamingToolCallDetector,
+    aexecute_tool,
+    aexecute_tools,
+    execute_tool,
+    execute_tools,
+    extract_tool_calls,
+)
+from tools.registry import DIRECT_ANSWER_TOOL_NAMES, TOOLS
+from tools.weather import CITY_COORDS, parse_day
+
 
+# Tools executadas pelo cliente (app movel), devolvidas como client_action
+MOBILE_TOOL_NAMES = {"open_website", "open_app", "open_youtube"}
 
 WEEKDAYS_PT = (
     "segunda-feira",
@@ -93,348 +108,499 @@ def build_weekday_reply(now: datetime) -> str:
     return f"Hoje e {WEEKDAYS_PT[now.weekday()]}."
 
 
-class AssistantService:
-    """Mantem sessoes em memoria e processa mensagens do utilizador."""
-
-    def __init__(self, enable_desktop_tools: bool = False):
-        self.enable_desktop_tools = enable_desktop_tools
-        self.available_tools = TOOLS
-        self.sessions = {}
-        self.lock = Lock()
-        init_db()
-
-    def create_session(self) -> dict:
-        session_id = str(uuid4())
-        messages = [{"role": "system", "content": build_system_prompt(self.available_tools)}]
-
-        with self.lock:
-            self.sessions[session_id] = messages
-
-        return {
-            "session_id": session_id,
-            "tools": self.available_tools,
-            "desktop_tools_enabled": self.enable_desktop_tools,
-        }
-
-    def delete_session(self, session_id: str) -> bool:
-        with self.lock:
-            return self.sessions.pop(session_id, None) is not None
-
-    def chat(self, session_id: str, user_message: str) -> dict:
-        with self.lock:
-            messages = self.sessions.get(session_id)
-
-            if messages is None:
-                raise KeyError(f"Sessao desconhecida: {session_id}")
-
-            if not user_message or not user_message.strip():
-                raise ValueError("A mensagem do utilizador nao pode estar vazia.")
-
-            user_message = user_message.strip()
-            msg = normalize_text(user_message)
-
-            if any(x in msg for x in ["que horas", "horas sao", "as horas", "hora atual"]):
-                now = datetime.now().astimezone()
-                return {
-                    "session_id": session_id,
-                    "reply": build_time_reply(now),
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
-
-            if any(x in msg for x in ["que dia e hoje", "qual e a data", "data de hoje", "em que dia estamos", "dia de hoje"]):
-                now = datetime.now().astimezone()
-                return {
-                    "session_id": session_id,
-                    "reply": build_date_reply(now),
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
-
-            if any(x in msg for x in ["que dia da semana", "dia da semana"]):
-                now = datetime.now().astimezone()
-                return {
-                    "session_id": session_id,
-                    "reply": build_weekday_reply(now),
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
+intent_router = IntentRouter()
+"""Intencoes rapidas resolvidas sem LLM. Registar novas com intent_router.register."""
 
-            # =========================
-            # COMANDOS DIRETOS (PC)
-            # =========================
 
-            if any(x in msg for x in ["fecha", "fechar"]) and "janela" in msg:
-                return {
-                    "session_id": session_id,
-                    "reply": "A fechar a janela.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": {
-                        "type": "pc_action",
-                        "action": "close_window"
-                    }
-                }
+@intent_router.register("time", ["que horas", "horas sao", "as horas", "hora atual"])
+def handle_time(service, session_id, messages, user_message, msg, match):
+    return service.build_response(session_id, build_time_reply(datetime.now().astimezone()))
 
-            if "volume" in msg and ("aumenta" in msg or "subir" in msg):
-                return {
-                    "session_id": session_id,
-                    "reply": "A aumentar o volume.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": {
-                        "type": "pc_action",
-                        "action": "volume_up"
-                    }
-                }
 
-            if "volume" in msg and ("baixa" in msg or "diminuir" in msg):
-                return {
-                    "session_id": session_id,
-                    "reply": "A baixar o volume.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": {
-                        "type": "pc_action",
-                        "action": "volume_down"
-                    }
-                }
+@intent_router.register("date", ["que dia e hoje", "qual e a data", "data de hoje", "em que dia estamos", "dia de hoje"])
+def handle_date(service, session_id, messages, user_message, msg, match):
+    return service.build_response(session_id, build_date_reply(datetime.now().astimezone()))
 
-            if "screenshot" in msg or "captura" in msg:
-                return {
-                    "session_id": session_id,
-                    "reply": "A tirar screenshot.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": {
-                        "type": "pc_action",
-                        "action": "screenshot"
-                    }
-                }
 
-            # =========================
-            # COMANDOS DE MEMÃƒÆ’Ã¢â‚¬Å“RIA
-            # =========================
+@intent_router.register("weekday", ["que dia da semana", "dia da semana"])
+def handle_weekday(service, session_id, messages, user_message, msg, match):
+    return service.build_response(session_id, build_weekday_reply(datetime.now().astimezone()))
 
-            if any(x in msg for x in ["memÃƒÆ’Ã‚Â³ria", "memoria", "lembretes", "preferÃƒÆ’Ã‚Âªncias", "preferencias"]) and any(y in msg for y in ["mostra", "lista", "ver", "mostrar"]):
-                facts = load_facts()
-                table_format = "tabela" in msg or "table" in msg
 
-                if table_format:
-                    # Formato de tabela
-                    reply_lines = ["| ID | Tipo | ConteÃƒÆ’Ã‚Âºdo |", "|----|------|---------|"]
+# =========================
+# COMANDOS DIRETOS (PC)
+# =========================
 
-                    if "name" in facts:
-                        reply_lines.append(f"| - | Nome | {facts['name']} |")
+def _pc_action(reply: str, action: str):
+    def handler(service, session_id, messages, user_message, msg, match):
+        return service.build_response(
+            session_id,
+            reply,
+            client_action={"type": "pc_action", "action": action},
+        )
 
-                    preferences = facts.get("preferences", [])
-                    for i, pref in enumerate(preferences, 1):
-                        reply_lines.append(f"| {i} | PreferÃƒÆ’Ã‚Âªncia | {pref} |")
+    return handler
 
-                    reminders = facts.get("reminders", [])
-                    for i, rem in enumerate(reminders, 1):
-                        reply_lines.append(f"| {i} | Lembrete | {rem} |")
 
-                    if not preferences and not reminders and "name" not in facts:
-                        reply_lines.append("| - | - | Nenhuma informaÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o guardada |")
+intent_router.register("close_window", ["fecha", "fechar"], "janela")(_pc_action("A fechar a janela.", "close_window"))
+intent_router.register("volume_up", "volume", ["aumenta", "subir"])(_pc_action("A aumentar o volume.", "volume_up"))
+intent_router.register("volume_down", "volume", ["baixa", "diminuir"])(_pc_action("A baixar o volume.", "volume_down"))
+intent_router.register("screenshot", ["screenshot", "captura"])(_pc_action("A tirar screenshot.", "screenshot"))
 
-                    reply = "\n".join(reply_lines)
-                else:
-                    # Formato de lista (original)
-                    response_parts = []
 
-                    if "name" in facts:
-                        response_parts.append(f"Nome guardado: {facts['name']}")
+# =========================
+# COMANDOS DE MEMORIA
+# =========================
 
-                    preferences = facts.get("preferences", [])
-                    if preferences:
-                        response_parts.append("PreferÃƒÆ’Ã‚Âªncias:")
-                        for i, pref in enumerate(preferences, 1):
-                            response_parts.append(f"  {i}. {pref}")
-                    else:
-                        response_parts.append("Nenhuma preferÃƒÆ’Ã‚Âªncia guardada.")
+@intent_router.register(
+    "list_memory",
+    ["memoria", "lembretes", "preferencias"],
+    ["mostra", "lista", "ver", "mostrar"],
+)
+def handle_list_memory(service, session_id, messages, user_message, msg, match):
+    facts = load_facts()
+    preferences = facts.get("preferences", [])
+    reminders = facts.get("reminders", [])
+
+    if "tabela" in msg or "table" in msg:
+        reply_lines = ["| ID | Tipo | Conteudo |", "|----|------|---------|"]
+
+        if "name" in facts:
+            reply_lines.append(f"| - | Nome | {facts['name']} |")
+
+        for i, pref in enumerate(preferences, 1):
+            reply_lines.append(f"| {i} | Preferencia | {pref} |")
+
+        for i, rem in enumerate(reminders, 1):
+            reply_lines.append(f"| {i} | Lembrete | {rem} |")
+
+        if not preferences and not reminders and "name" not in facts:
+            reply_lines.append("| - | - | Nenhuma informacao guardada |")
+
+        return service.build_response(session_id, "\n".join(reply_lines))
+
+    response_parts = []
+
+    if "name" in facts:
+        response_parts.append(f"Nome guardado: {facts['name']}")
+
+    if preferences:
+        response_parts.append("Preferencias:")
+        for i, pref in enumerate(preferences, 1):
+            response_parts.append(f"  {i}. {pref}")
+    else:
+        response_parts.append("Nenhuma preferencia guardada.")
+
+    if reminders:
+        response_parts.append("Lembretes:")
+        for i, rem in enumerate(reminders, 1):
+            response_parts.append(f"  {i}. {rem}")
+    else:
+        response_parts.append("Nenhum lembrete guardado.")
+
+    return service.build_response(session_id, "\n".join(response_parts))
+
+
+@intent_router.register("remove_preference", "remove", "preferencia", pattern=r"remover?\s+preferencia\s+(\d+)")
+def handle_remove_preference(service, session_id, messages, user_message, msg, match):
+    index = int(match.group(1))
+    delete_preference(index)
+    return service.build_response(session_id, f"Preferencia {index} removida da memoria.")
+
+
+@intent_router.register("remove_reminder", "remove", "lembrete", pattern=r"remover?\s+lembrete\s+(\d+)")
+def handle_remove_reminder(service, session_id, messages, user_message, msg, match):
+    index = int(match.group(1))
+    delete_reminder(index)
+    return service.build_response(session_id, f"Lembrete {index} removido da memoria.")
+
+
+@intent_router.register("clear_memory", ["limpa", "limpar", "esquece", "esquecer"], "memoria")
+def handle_clear_memory(service, session_id, messages, user_message, msg, match):
+    clear_memory()
+    return service.build_response(session_id, "Toda a memoria foi limpa.")
+
+
+# =========================
+# COMANDOS DE CLIMA (fallback local rapido)
+# =========================
+
+@intent_router.register("weather", "tempo")
+def handle_weather(service, session_id, messages, user_message, msg, match):
+    day_offset = parse_day(msg)
+
+    # Todas as cidades nomeadas, pela ordem da mensagem
+    # (ex: "tempo em Lisboa e no Porto amanha")
+    cities = [city for _, city in sorted((msg.find(known), known) for known in CITY_COORDS if known in msg)]
+
+    if not cities:
+        # Cidade padrao: a preferencia mais parecida com o pedido que nomeie
+        # uma cidade conhecida. So pesquisa por palavras (FTS5): esta
+        # resposta rapida nao deve esperar por embeddings do Ollama.
+        city = "Lisboa"
+        for memory in (yield from service.recall_memories(user_message, limit=3, semantic=False)):
+            if memory["type"] != "preference":
+                continue
+            preference = normalize_text(memory["value"])
+            preferred_city = next((known for known in CITY_COORDS if known in preference), None)
+            if preferred_city:
+                city = preferred_city
+                break
+        cities = [city]
+
+    tool_calls = [
+        {
+            "type": "tool_call",
+            "tool_name": "get_weather",
+            "arguments": {"city": city, "day_offset": day_offset},
+        }
+        for city in cities
+    ]
 
-                    reminders = facts.get("reminders", [])
-                    if reminders:
-                        response_parts.append("Lembretes:")
-                        for i, rem in enumerate(reminders, 1):
-                            response_parts.append(f"  {i}. {rem}")
-                    else:
-                        response_parts.append("Nenhum lembrete guardado.")
+    if len(tool_calls) == 1:
+        results = [(yield ("execute_tool", "get_weather", tool_calls[0]["arguments"]))]
+    else:
+        # Varias cidades: as previsoes sao pedidas em paralelo
+        results = yield ("execute_tools", tool_calls, service.enable_desktop_tools)
 
-                    reply = "\n".join(response_parts)
+    calls_json = tool_calls[0] if len(tool_calls) == 1 else tool_calls
+    messages.append({"role": "user", "content": user_message})
+    messages.append({"role": "assistant", "content": json.dumps(calls_json, ensure_ascii=False)})
+    for result in results:
+        messages.append({"role": "tool", "content": json.dumps(result, ensure_ascii=False)})
 
-                return {
-                    "session_id": session_id,
-                    "reply": reply,
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
+    if all(result.get("ok") for result in results) and "get_weather" in DIRECT_ANSWER_TOOL_NAMES:
+        reply = " ".join(str(result.get("data")) for result in results)
+    else:
+        # passar resultado para LLM para resposta mais natural
+        reply = yield from service.ask_llm(messages)
 
-            # Remover preferÃƒÆ’Ã‚Âªncia
-            import re
-            match = re.search(r"remove\s+preferÃƒÆ’Ã‚Âªncia\s+(\d+)|remover\s+preferencia\s+(\d+)", msg, re.IGNORECASE)
-            if match:
-                index = int(match.group(1) or match.group(2))
-                delete_preference(index)
-                return {
-                    "session_id": session_id,
-                    "reply": f"PreferÃƒÆ’Ã‚Âªncia {index} removida da memÃƒÆ’Ã‚Â³ria.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
+    messages.append({"role": "assistant", "content": reply})
+    trim_history(messages)
 
-            # Remover lembrete
-            match = re.search(r"remove\s+lembrete\s+(\d+)|remover\s+lembrete\s+(\d+)", msg, re.IGNORECASE)
-            if match:
-                index = int(match.group(1) or match.group(2))
-                delete_reminder(index)
-                return {
-                    "session_id": session_id,
-                    "reply": f"Lembrete {index} removido da memÃƒÆ’Ã‚Â³ria.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
+    return service.build_response(session_id, reply, tool_result=results[0], tool_results=results)
 
-            # Limpar toda a memÃƒÆ’Ã‚Â³ria
-            if any(x in msg for x in ["limpa", "limpar", "esquece", "esquecer"]) and "memÃƒÆ’Ã‚Â³ria" in msg or "memoria" in msg:
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                c.execute("DELETE FROM user_memory")
-                conn.commit()
-                conn.close()
-                return {
-                    "session_id": session_id,
-                    "reply": "Toda a memÃƒÆ’Ã‚Â³ria foi limpa.",
-                    "tool_result": None,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
 
-            # =========================
-            # COMANDOS DE CLIMA (fallback local rápido)
-            # =========================
-
-            if "tempo" in msg:
-                day_offset = parse_day(msg)
-                city = "Lisboa"
-
-                # Verificar preferencias para cidade padrão
-                facts = load_facts()
-                preferences = facts.get("preferences", [])
-                for pref in preferences:
-                    if "tempo" in pref.lower() and "caldas da rainha" in pref.lower():
-                        city = "caldas da rainha"
-                        break
-
-                for known_city in CITY_COORDS.keys():
-                    if known_city in msg:
-                        city = known_city
-                        break
-
-                executed_tool = execute_tool("get_weather", {"city": city, "day_offset": day_offset})
-
-                # passar resultado para LLM para resposta mais natural
-                tool_call = {
-                    "type": "tool_call",
-                    "tool_name": "get_weather",
-                    "arguments": {"city": city, "day_offset": day_offset},
-                }
+class AssistantService:
+    """Mantem sessoes em memoria e processa mensagens do utilizador."""
 
-                messages.append({"role": "user", "content": user_message})
-                messages.append({"role": "assistant", "content": json.dumps(tool_call, ensure_ascii=False)})
-                messages.append({"role": "tool", "content": json.dumps(executed_tool, ensure_ascii=False)})
+    def __init__(self, enable_desktop_tools: bool = False, response_cache: bool = RESPONSE_CACHE_ENABLED):
+        self.enable_desktop_tools = enable_desktop_tools
+        self.available_tools = TOOLS
+        # Tools enviadas no campo "tools" do Ollama (None: descritas no system prompt)
+        self.llm_tools = TOOLS if OLLAMA_NATIVE_TOOLS else None
+        self.intents = intent_router
+        # Cada sessao tem o seu lock, para que sessoes diferentes possam
+        # chamar o LLM em paralelo; sessoes inativas ficam so no backend.
+        self.sessions = SessionStore()
+        self.response_cache = ResponseCache() if response_cache else None
+        init_db()
 
-                reply = call_llm(messages)
+    def build_response(self, session_id: str, reply: str, tool_result=None, client_action=None, tool_results=None) -> dict:
+        if tool_results is None and tool_result is not None:
+            tool_results = [tool_result]
 
-                return {
-                    "session_id": session_id,
-                    "reply": reply,
-                    "tool_result": executed_tool,
-                    "desktop_tools_enabled": self.enable_desktop_tools,
-                    "client_action": None,
-                }
+        return {
+            "session_id": session_id,
+            "reply": reply,
+            "tool_result": tool_result,
+            "tool_results": tool_results,
+            "desktop_tools_enabled": self.enable_desktop_tools,
+            "client_action": client_action,
+        }
 
-            # =========================
-            # CONTINUA FLUXO NORMAL
-            # =========================
+    def create_session(self) -> dict:
+        session_id = str(uuid4())
+        messages = [{"role": "system", "content": build_system_prompt(self.available_tools)}]
 
-            messages.append({"role": "user", "content": user_message})
+        self.sessions.create(session_id, messages)
 
-            extract_user_facts(user_message)
-            messages[0]["content"] = build_system_prompt(self.available_tools)
+        return {
+            "session_id": session_id,
+            "tools": self.available_tools,
+            "desktop_tools_enabled": self.enable_desktop_tools,
+        }
 
-            first_reply = call_llm(messages)
+    def delete_session(self, session_id: str) -> bool:
+        return self.sessions.delete(session_id)
 
-            # Tentar converter resposta em JSON
-            parsed = None
+    def chat(self, session_id: str, user_message: str) -> dict:
+        # Mensagens da mesma sessao sao processadas por ordem; o registo de
+        # sessoes nunca fica bloqueado durante chamadas ao LLM ou a tools.
+        with self.sessions.use(session_id) as entry:
+            return self._run_turn(self._chat_turn(session_id, entry.messages, user_message))
+
+    async def achat(self, session_id: str, user_message: str) -> dict:
+        """
+        Versao assincrona de chat para o servidor HTTP.
+
+        Enquanto espera pelo LLM ou por tools, a sessao ocupa apenas uma
+        coroutine. Cada sessao deve ser usada so por chat ou so por achat,
+        porque os locks de cada modo sao independentes.
+        """
+        async with self.sessions.ause(session_id) as entry:
+            return await self._arun_turn(self._chat_turn(session_id, entry.messages, user_message))
+
+    def stream_chat(self, session_id: str, user_message: str):
+        """
+        Versao em streaming de achat.
+
+        Valida a mensagem de imediato (ValueError) e devolve um gerador
+        assincrono de eventos:
+        - {"type": "delta", "data": {"content": ...}} por cada token da resposta
+        - {"type": "done", "data": {...}} com a resposta final, como em chat
+
+        Uma sessao desconhecida so da KeyError ao pedir o primeiro evento:
+        confirma-la pode ler o SQLite, o que ause faz fora do event loop.
+        """
+        if not user_message or not user_message.strip():
+            raise ValueError("A mensagem do utilizador nao pode estar vazia.")
+
+        return self._astream_turn(session_id, user_message)
+
+    async def _astream_turn(self, session_id: str, user_message: str):
+        started = time.perf_counter()
+        first_token_at = None
+        async with self.sessions.ause(session_id) as entry:
+            async for event in self._astream_events(session_id, entry.messages, user_message):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if event["type"] == "done":
+                    event["data"]["time_to_first_token_ms"] = round((first_token_at - started) * 1000, 1)
+                yield event
+
+    async def _astream_events(self, session_id: str, messages: list, user_message: str):
+        turn = self._chat_turn(session_id, messages, user_message)
+        result = error = None
+
+        while True:
             try:
-                parsed = json.loads(first_reply)
-            except Exception:
-                pass
-
-            tool_call = None
-
-            if isinstance(parsed, dict) and parsed.get("type") == "tool_call":
-                tool_call = parsed
-
-            if not tool_call:
-                tool_call = extract_tool_call(first_reply)
-
-            client_action = None
-            executed_tool = None
-            reply = first_reply
+                effect = turn.throw(error) if error is not None else turn.send(result)
+            except StopIteration as stop:
+                yield {"type": "done", "data": dict(stop.value)}
+                return
 
-            # ÃƒÂ°Ã…Â¸Ã¢â‚¬ÂÃ‚Â§ Converter tool ÃƒÂ¢Ã¢â‚¬Â Ã¢â‚¬â„¢ aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o Flutter
-            def build_client_action(tool_call: dict):
-                tool_name = tool_call.get("tool_name")
-                args = tool_call.get("arguments", {}) or {}
-
-                if tool_name in ["open_app", "open_youtube"]:
-                    app_name = (args.get("app_name") or "").strip().lower()
+            name, *args = effect
+            try:
+                if name == "call_llm":
+                    parts = []
+                    async for event in self._astream_reply(*args, parts=parts):
+                        yield event
+                    result = "".join(parts).strip()
+                elif name == "execute_tools":
+                    result = await aexecute_tools(*args)
+                elif name == "relevant_memories":
+                    result = await arelevant_memories(*args)
+                elif name == "cache_get":
+                    result = await ResponseCache.aget(*args)
+                elif name == "cache_put":
+                    result = await ResponseCache.aput(*args)
+                else:
+                    result = await aexecute_tool(*args)
+                error = None
+            except Exception as exc:
+                result, error = None, exc
+
+    async def _astream_reply(self, messages: list, tools=None, *, parts: list):
+        """
+        Encaminha os tokens do LLM como deltas, guardando o texto em parts.
+
+        O texto normal segue logo para o cliente. Um objeto JSON fica retido
+        ate fechar; se for um tool call, a geracao e cancelada nesse momento
+        para que a tool arranque sem esperar pelo resto da resposta.
+        """
+        detector = StreamingToolCallDetector()
+        stream = astream_llm(messages, tools)
+
+        try:
+            async for token in stream:
+                visible = detector.feed(token)
+                if visible:
+                    yield {"type": "delta", "data": {"content": visible}}
+                if detector.tool_calls is not None:
+                    break
+        finally:
+            # Fecha a ligacao ao Ollama, que deixa de gerar tokens.
+            await stream.aclose()
+
+        rest = detector.finish()
+        if rest:
+            yield {"type": "delta", "data": {"content": rest}}
+
+        parts.append(detector.text)
+
+    def _run_turn(self, turn):
+        """Executa os pedidos de um turno (LLM e tools) de forma bloqueante."""
+        handlers = {
+            "call_llm": call_llm,
+            "execute_tool": execute_tool,
+            "execute_tools": execute_tools,
+            "relevant_memories": relevant_memories,
+            "cache_get": ResponseCache.get,
+            "cache_put": ResponseCache.put,
+        }
+        result = error = None
 
-                    if tool_name == "open_youtube":
-                        app_name = "youtube"
+        while True:
+            try:
+                effect = turn.throw(error) if error is not None else turn.send(result)
+            except StopIteration as stop:
+                return stop.value
 
-                    if not app_name:
-                        return None
+            name, *args = effect
+            try:
+                result, error = handlers[name](*args), None
+            except Exception as exc:
+                result, error = None, exc
+
+    async def _arun_turn(self, turn):
+        """Executa os pedidos de um turno com o cliente HTTP assincrono."""
+        handlers = {
+            "call_llm": acall_llm,
+            "execute_tool": aexecute_tool,
+            "execute_tools": aexecute_tools,
+            "relevant_memories": arelevant_memories,
+            "cache_get": ResponseCache.aget,
+            "cache_put": ResponseCache.aput,
+        }
+        result = error = None
 
-                    if app_name in ["youtube", "yt"]:
-                        return {
-                            "type": "open_url",
-                            "url": "https://www.youtube.com",
-                        }
+        while True:
+            try:
+                effect = turn.throw(error) if error is not None else turn.send(result)
+            except StopIteration as stop:
+                return stop.value
 
+            name, *args = effect
+            try:
+                result, error = await handlers[name](*args), None
+            except Exception as exc:
+                result, error = None, exc
+
+    def ask_llm(self, messages: list, tools=None):
+        """
+        Pede uma resposta ao LLM dentro de um turno (usar com yield from).
+
+        Antes de cada pedido o historico e ajustado ao orcamento de tokens,
+        incluindo resultados de tools acabados de acrescentar. Com tools o
+        modelo pode responder com um tool call nativo.
+        """
+        trim_history(messages)
+        return (yield ("call_llm", messages, tools))
+
+    def recall_memories(self, text: str, limit: int = MEMORY_TOP_K, semantic: bool = True):
+        """
+        Preferencias e lembretes relevantes para text (usar com yield from).
+
+        A pesquisa pode pedir embeddings ao Ollama, por isso e um pedido do
+        turno como call_llm: o modo assincrono corre-a fora do event loop.
+        Com semantic=False so usa a pesquisa por palavras (FTS5).
+        """
+        return (yield ("relevant_memories", text, limit, semantic))
+
+    def _chat_turn(self, session_id: str, messages: list, user_message: str):
+        """
+        Logica de um turno, independente do modo de I/O.
+
+        E um gerador: em vez de chamar o LLM ou as tools diretamente, faz
+        yield de ("call_llm", messages, tools), ("execute_tool", nome, args[, desktop]),
+        ("execute_tools", tool_calls, desktop), ("relevant_memories", texto, limite, semantic),
+        ("cache_get", cache, chave) ou ("cache_put", cache, chave, resposta) e recebe o resultado. Assim chat e achat partilham o mesmo fluxo.
+        """
+        if not user_message or not user_message.strip():
+            raise ValueError("A mensagem do utilizador nao pode estar vazia.")
+
+        user_message = user_message.strip()
+        msg = normalize_text(user_message)
+
+        routed = self.intents.route(msg)
+        if routed is not None:
+            result = routed.handler(self, session_id, messages, user_message, msg, routed.match)
+            if inspect.isgenerator(result):
+                result = yield from result
+            if result is not None:
+                return result
+
+        # =========================
+        # CONTINUA FLUXO NORMAL
+        # =========================
+
+        # As memorias relevantes vao junto da mensagem (e ficam no historico),
+        # para o system prompt e as mensagens anteriores nao mudarem
+        memories = (yield from self.recall_memories(user_message)) if MEMORY_RETRIEVAL else []
+        memory_context = build_memory_context(memories)
+        messages.append({"role": "user", "content": memory_context + user_message})
+
+        extract_user_facts(user_message)
+        messages[0]["content"] = build_system_prompt(self.available_tools)
+
+        # So perguntas sem historico (apenas system prompt + esta mensagem)
+        # usam a cache de respostas. Um tool call em cache continua a ser
+        # executado agora, por isso os dados das tools nunca ficam velhos.
+        response_key = None
+        first_reply = None
+        if self.response_cache is not None and len(messages) == 2:
+            response_key = cache_key(msg, messages[0]["content"] + memory_context)
+            first_reply = yield ("cache_get", self.response_cache, response_key)
+
+        if first_reply is None:
+            first_reply = yield from self.ask_llm(messages, self.llm_tools)
+            if response_key is not None:
+                yield ("cache_put", self.response_cache, response_key, first_reply)
+
+        # Tentar converter resposta em tool calls (um objeto JSON ou uma lista)
+        tool_calls = extract_tool_calls(first_reply)
+
+        client_action = None
+        executed_tool = None
+        tool_results = []
+        reply = first_reply
+
+        # ÃƒÂ°Ã…Â¸Ã¢â‚¬ÂÃ‚Â§ Converter tool ÃƒÂ¢Ã¢â‚¬Â Ã¢â‚¬â„¢ aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o Flutter
+        def build_client_action(tool_call: dict):
+            tool_name = tool_call.get("tool_name")
+            args = tool_call.get("arguments", {}) or {}
+
+            if tool_name in ["open_app", "open_youtube"]:
+                app_name = (args.get("app_name") or "").strip().lower()
+
+                if tool_name == "open_youtube":
+                    app_name = "youtube"
+
+                if not app_name:
+                    return None
+
+                if app_name in ["youtube", "yt"]:
                     return {
-                        "type": "open_app",
-                        "app_name": app_name,
+                        "type": "open_url",
+                        "url": "https://www.youtube.com",
                     }
 
-                if tool_name == "open_website":
-                    url = (args.get("url") or "").strip()
+                return {
+                    "type": "open_app",
+                    "app_name": app_name,
+                }
 
-                    if not url:
-                        return None
+            if tool_name == "open_website":
+                url = (args.get("url") or "").strip()
 
-                    if not url.startswith("http"):
-                        url = "https://" + url
+                if not url:
+                    return None
 
-                    return {
-                        "type": "open_url",
-                        "url": url,
-                    }
+                if not url.startswith("http"):
+                    url = "https://" + url
 
-                return None
+                return {
+                    "type": "open_url",
+                    "url": url,
+                }
 
-            # PROCESSAMENTO DE TOOL
-            if tool_call:
-                try:
+            return None
+
+        # PROCESSAMENTO DE TOOLS
+        if tool_calls:
+            try:
+                for tool_call in tool_calls:
                     args = tool_call.get("arguments", {})
 
                     if isinstance(args, str):
@@ -447,72 +613,83 @@ class AssistantService:
                         args = {}
 
                     tool_call["arguments"] = args
+
+                mobile_calls = [call for call in tool_calls if call.get("tool_name") in MOBILE_TOOL_NAMES]
+                backend_calls = [call for call in tool_calls if call.get("tool_name") not in MOBILE_TOOL_NAMES]
+
+                # ÃƒÂ°Ã…Â¸Ã¢â‚¬ËœÃ¢â‚¬Â° aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Âµes mobile (o cliente executa uma de cada vez)
+                if mobile_calls:
+                    tool_call = mobile_calls[0]
                     tool_name = tool_call.get("tool_name")
+                    client_action = build_client_action(tool_call)
 
-                    # ÃƒÂ°Ã…Â¸Ã¢â‚¬ËœÃ¢â‚¬Â° aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Âµes mobile
-                    if tool_name in {"open_website", "open_app", "open_youtube"}:
-                        client_action = build_client_action(tool_call)
+                    if client_action:
+                        executed_tool = {
+                            "tool_name": tool_name,
+                            "ok": True,
+                            "data": "AÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o enviada para o cliente.",
+                        }
 
-                        if client_action:
-                            executed_tool = {
-                                "tool_name": tool_name,
-                                "ok": True,
-                                "data": "AÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o enviada para o cliente.",
-                            }
+                        reply = "A executar a aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o."
+                    else:
+                        executed_tool = {
+                            "tool_name": tool_name,
+                            "ok": False,
+                            "data": "Erro ao converter aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o.",
+                        }
 
-                            reply = "A executar a aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o."
-                        else:
-                            executed_tool = {
-                                "tool_name": tool_name,
-                                "ok": False,
-                                "data": "Erro ao converter aÃƒÆ’Ã‚Â§ÃƒÆ’Ã‚Â£o.",
-                            }
+                        reply = executed_tool["data"]
 
-                            reply = executed_tool["data"]
+                    tool_results.append(executed_tool)
 
-                    # ÃƒÂ°Ã…Â¸Ã¢â‚¬ËœÃ¢â‚¬Â° outras tools backend
-                    else:
-                        executed_tool = execute_tool(
-                            tool_name,
-                            args,
-                            allow_desktop_tools=self.enable_desktop_tools,
-                        )
+                # ÃƒÂ°Ã…Â¸Ã¢â‚¬ËœÃ¢â‚¬Â° outras tools backend, todas em paralelo
+                if backend_calls:
+                    results = yield (
+                        "execute_tools",
+                        backend_calls,
+                        self.enable_desktop_tools,
+                    )
+                    tool_results.extend(results)
 
-                        messages.append({
-                            "role": "assistant",
-                            "content": json.dumps(tool_call, ensure_ascii=False),
-                        })
+                    calls_json = backend_calls[0] if len(backend_calls) == 1 else backend_calls
+                    messages.append({
+                        "role": "assistant",
+                        "content": json.dumps(calls_json, ensure_ascii=False),
+                    })
 
+                    for result in results:
                         messages.append({
                             "role": "tool",
-                            "content": json.dumps(executed_tool, ensure_ascii=False),
+                            "content": json.dumps(result, ensure_ascii=False),
                         })
 
-                        if executed_tool.get("ok"):
-                            if tool_name in {"get_weather", "search_web"}:
-                                # fornecer a resposta da tool ao LLM e deixar o LLM reformular para a pergunta
-                                reply = call_llm(messages)
-                            else:
-                                reply = call_llm(messages)
-                        else:
-                            reply = f"Nao consegui executar: {executed_tool.get('data')}"
+                    if all(result.get("ok") and result.get("tool_name") in DIRECT_ANSWER_TOOL_NAMES for result in results):
+                        # os resultados ja sao a resposta final
+                        reply = " ".join(str(result.get("data")) for result in results)
+                    elif any(result.get("ok") for result in results):
+                        # fornecer todos os resultados ao LLM numa unica chamada de seguimento
+                        reply = yield from self.ask_llm(messages)
+                    else:
+                        reply = "Nao consegui executar: " + "; ".join(str(result.get("data")) for result in results)
 
-                except Exception as e:
-                    print("ERRO TOOL:", e)
-                    reply = f"Erro ao executar ferramenta: {str(e)}"
+                executed_tool = tool_results[0] if tool_results else None
 
-            messages.append({"role": "assistant", "content": reply})
+            except Exception as e:
+                print("ERRO TOOL:", e)
+                reply = f"Erro ao executar ferramenta: {str(e)}"
 
-            if len(messages) > 1 + MAX_TURNS * 2:
-                messages[:] = messages[:1] + messages[-MAX_TURNS * 2:]
+        messages.append({"role": "assistant", "content": reply})
 
-            return {
-                "session_id": session_id,
-                "reply": reply,
-                "tool_result": executed_tool,
-                "desktop_tools_enabled": self.enable_desktop_tools,
-                "client_action": client_action,
-            }
+        trim_history(messages)
+
+        return {
+            "session_id": session_id,
+            "reply": reply,
+            "tool_result": executed_tool,
+            "tool_results": tool_results or None,
+            "desktop_tools_enabled": self.enable_desktop_tools,
+            "client_action": client_action,
+        }
         
 def build_client_action(tool_call: dict) -> dict | None:
     tool_name = tool_call.get("tool_name")
@@ -0,0 +1,539 @@
+"""
+Armazenamento das sessoes de conversa.
+
+As sessoes ativas vivem em memoria, ordenadas por utilizacao (LRU).
+Quando ha demasiadas sessoes, quando excedem o orcamento de memoria ou
+quando ficam inativas mais do que o TTL, sao guardadas num backend
+persistente e voltam para memoria no proximo pedido.
+
+Em modo partilhado (varios workers do servidor) o backend passa a ser a
+fonte de verdade: cada turno le a versao mais recente da sessao e grava o
+resultado com controlo de concorrencia otimista, por isso qualquer worker
+pode servir qualquer sessao.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock
+
+from config import (
+    SESSION_DB,
+    SESSION_DB_TTL,
+    SESSION_IDLE_TTL,
+    SESSION_MAX_BYTES,
+    SESSION_MAX_COUNT,
+    SESSION_SHARED,
+)
+
+
+class SessionConflictError(RuntimeError):
+    """A sessao foi alterada por outro processo desde que foi lida."""
+
+
+def estimate_session_bytes(messages: list) -> int:
+    """Estimativa barata da memoria ocupada pelo historico de uma sessao."""
+    return sum(64 + len(message.get("content") or "") for message in messages)
+
+
+class SessionBackend:
+    """
+    Interface de armazenamento persistente de sessoes.
+
+    Cada sessao guarda o historico (lista de mensagens) e um numero de
+    versao que aumenta em cada escrita. Um backend Redis, por exemplo,
+    pode guardar ambos num hash e implementar save com WATCH/MULTI.
+    """
+
+    def load(self, session_id: str) -> tuple[list, int] | None:
+        """Devolve (mensagens, versao) ou None se a sessao nao existir."""
+        raise NotImplementedError
+
+    def version(self, session_id: str) -> int | None:
+        """Devolve apenas a versao atual, ou None se a sessao nao existir."""
+        raise NotImplementedError
+
+    def save(self, session_id: str, messages: list, expected_version: int | None) -> int:
+        """
+        Grava a sessao e devolve a nova versao.
+
+        Com expected_version=None a escrita e incondicional; caso contrario
+        levanta SessionConflictError se a versao guardada for diferente.
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def purge(self, older_than: float) -> int:
+        """Apaga sessoes sem uso desde o timestamp indicado."""
+        raise NotImplementedError
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Backend SQLite em modo WAL, partilhavel entre processos na mesma maquina."""
+
+    def __init__(self, path: str = SESSION_DB):
+        self.path = path
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                messages TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """
+        )
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self, session_id):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT messages, version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def version(self, session_id):
+        conn = self._connect()
+        row = conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def save(self, session_id, messages, expected_version):
+        payload = json.dumps(messages, ensure_ascii=False)
+        now = time.time()
+        conn = self._connect()
+
+        try:
+            if expected_version is None:
+                row = conn.execute(
+                    """
+                    INSERT INTO sessions (session_id, messages, version, last_used) VALUES (?, ?, 1, ?)
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        messages = excluded.messages,
+                        version = sessions.version + 1,
+                        last_used = excluded.last_used
+                    RETURNING version
+                """,
+                    (session_id, payload, now),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    """
+                    UPDATE sessions SET messages = ?, version = version + 1, last_used = ?
+                    WHERE session_id = ? AND version = ?
+                    RETURNING version
+                """,
+                    (payload, now, session_id, expected_version),
+                ).fetchone()
+
+                if row is None:
+                    raise SessionConflictError(f"Sessao alterada em paralelo: {session_id}")
+
+            conn.commit()
+            return row[0]
+        finally:
+            conn.close()
+
+    def delete(self, session_id):
+        conn = self._connect()
+        deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+        conn.commit()
+        conn.close()
+        return deleted
+
+    def count(self):
+        conn = self._connect()
+        total = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        conn.close()
+        return total
+
+    def purge(self, older_than):
+        conn = self._connect()
+        purged = conn.execute("DELETE FROM sessions WHERE last_used < ?", (older_than,)).rowcount
+        conn.commit()
+        conn.close()
+        return purged
+
+
+class SessionMessages(list):
+    """
+    Historico de uma sessao que regista as mensagens acrescentadas.
+
+    append/extend guardam as mensagens novas em added, ate ao proximo
+    mark(). Substituicoes por slice (ex: trim_history) nao contam como
+    mensagens novas. Em modo partilhado, added sao as mensagens do turno
+    a juntar a versao mais recente quando ha conflito.
+    """
+
+    def __init__(self, messages=()):
+        super().__init__(messages)
+        self.added = []
+
+    def append(self, message):
+        super().append(message)
+        self.added.append(message)
+
+    def extend(self, messages):
+        messages = list(messages)
+        super().extend(messages)
+        self.added.extend(messages)
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def mark(self):
+        """Inicio de um turno: esquece as mensagens acrescentadas antes."""
+        self.added = []
+
+
+class SessionEntry:
+    """Historico de uma sessao e os locks que serializam os seus turnos."""
+
+    __slots__ = ("session_id", "messages", "version", "lock", "async_lock", "last_used", "size", "pins")
+
+    def __init__(self, session_id: str, messages: list, version: int | None = None):
+        self.session_id = session_id
+        self.messages = SessionMessages(messages)
+        self.version = version
+        self.lock = Lock()
+        self.async_lock = asyncio.Lock()
+        self.last_used = time.time()
+        self.size = estimate_session_bytes(messages)
+        self.pins = 0
+
+
+class SessionStore:
+    """
+    Registo de sessoes com limite de quantidade e de memoria.
+
+    Um turno usa a sessao atraves de use (ou ause no modo assincrono):
+
+        with store.use(session_id) as entry:
+            ...  # alterar entry.messages
+
+    Durante o bloco a sessao tem o seu lock adquirido e nunca e removida
+    da memoria. Com shared=True, ao entrar confirma-se a versao no backend
+    e ao sair grava-se o historico (ver SESSION_SHARED em config.py).
+    """
+
+    MAX_SAVE_ATTEMPTS = 5
+
+    def __init__(
+        self,
+        backend: SessionBackend | None = None,
+        shared: bool = SESSION_SHARED,
+        max_sessions: int = SESSION_MAX_COUNT,
+        max_bytes: int = SESSION_MAX_BYTES,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        backend_ttl: float = SESSION_DB_TTL,
+    ):
+        self.backend = backend or SQLiteSessionBackend()
+        self.shared = shared
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.backend_ttl = backend_ttl
+        self._entries: OrderedDict[str, SessionEntry] = OrderedDict()
+        # Sessoes retiradas da memoria cuja gravacao no backend ainda nao
+        # terminou: session_id -> (entry, copia do historico a gravar)
+        self._evicting: dict[str, tuple[SessionEntry, list]] = {}
+        self._bytes = 0
+        # _lock protege so os dicionarios (nunca e mantido durante I/O);
+        # _persist_lock serializa as gravacoes das sessoes removidas
+        self._lock = Lock()
+        self._persist_lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            if not self.shared and (session_id in self._entries or session_id in self._evicting):
+                return True
+
+        return self.backend.version(session_id) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            resident = len(self._entries)
+            resident_bytes = self._bytes
+
+        return {
+            "resident_sessions": resident,
+            "resident_bytes": resident_bytes,
+            "stored_sessions": self.backend.count(),
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "shared": self.shared,
+        }
+
+    def create(self, session_id: str, messages: list) -> None:
+        entry = SessionEntry(session_id, messages)
+
+        if self.shared:
+            entry.version = self.backend.save(session_id, messages, None)
+
+        with self._lock:
+            self._entries[session_id] = entry
+            self._bytes += entry.size
+            victims = self._evict_locked()
+
+        self._persist(victims)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+            pending = self._evicting.pop(session_id, None)
+
+        # Espera por uma gravacao em curso, para esta nao recriar a sessao
+        with self._persist_lock:
+            deleted = self.backend.delete(session_id)
+
+        return entry is not None or pending is not None or deleted
+
+    @contextmanager
+    def use(self, session_id: str):
+        """Usa a sessao durante um turno. Levanta KeyError se nao existir."""
+        entry = self.checkout(session_id)
+        try:
+            with entry.lock:
+                self._refresh(entry)
+                try:
+                    yield entry
+                finally:
+                    self._commit(entry)
+        finally:
+            self.checkin(entry)
+
+    @asynccontextmanager
+    async def ause(self, session_id: str):
+        """
+        Versao de use para coroutines, com o lock assincrono da sessao.
+
+        O acesso ao backend (carregar, gravar, remover da memoria) corre
+        numa thread, para nao bloquear o event loop.
+        """
+        entry = self._pin(session_id)
+        if entry is None:
+            entry = self._adopt(session_id, await asyncio.to_thread(self.backend.load, session_id))
+
+        try:
+            async with entry.async_lock:
+                if self.shared:
+                    await asyncio.to_thread(self._refresh, entry)
+                else:
+                    self._refresh(entry)
+                try:
+                    yield entry
+                finally:
+                    if self.shared:
+                        await asyncio.to_thread(self._commit, entry)
+                    else:
+                        self._commit(entry)
+        finally:
+            victims = self._release(entry)
+            if victims:
+                await asyncio.to_thread(self._persist, victims)
+
+    def checkout(self, session_id: str) -> SessionEntry:
+        """
+        Reserva a sessao, carregando-a do backend se nao estiver em memoria.
+
+        Levanta KeyError se a sessao nao existir.
+        """
+        entry = self._pin(session_id)
+        if entry is None:
+            entry = self._adopt(session_id, self.backend.load(session_id))
+        return entry
+
+    def checkin(self, entry: SessionEntry) -> None:
+        """Liberta a sessao e atualiza o seu tamanho depois de um turno."""
+        self._persist(self._release(entry))
+
+    def _pin(self, session_id: str) -> SessionEntry | None:
+        """Reserva a sessao se estiver em memoria (ou ainda a ser gravada)."""
+        with self._lock:
+            return self._pin_locked(session_id)
+
+    def _pin_locked(self, session_id: str) -> SessionEntry | None:
+        entry = self._entries.get(session_id)
+
+        if entry is None:
+            pending = self._evicting.pop(session_id, None)
+            if pending is None:
+                return None
+            # Volta para memoria; a gravacao pendente deixa de ser precisa
+            entry = pending[0]
+            self._entries[session_id] = entry
+            self._bytes += entry.size
+        else:
+            self._entries.move_to_end(session_id)
+
+        entry.pins += 1
+        entry.last_used = time.time()
+        return entry
+
+    def _adopt(self, session_id: str, loaded: tuple[list, int] | None) -> SessionEntry:
+        """Poe em memoria uma sessao lida do backend (fora do lock)."""
+        with self._lock:
+            # Outro pedido pode te-la carregado enquanto esta era lida
+            entry = self._pin_locked(session_id)
+            if entry is not None:
+                return entry
+
+            if loaded is None:
+                raise KeyError(f"Sessao desconhecida: {session_id}")
+
+            entry = SessionEntry(session_id, *loaded)
+            self._entries[session_id] = entry
+            self._bytes += entry.size
+            entry.pins += 1
+            return entry
+
+    def _release(self, entry: SessionEntry) -> list:
+        """Liberta a reserva e escolhe as sessoes a remover da memoria."""
+        with self._lock:
+            entry.pins -= 1
+            entry.last_used = time.time()
+
+            if self._entries.get(entry.session_id) is entry:
+                size = estimate_session_bytes(entry.messages)
+                self._bytes += size - entry.size
+                entry.size = size
+
+            return self._evict_locked()
+
+    def _refresh(self, entry: SessionEntry) -> None:
+        """Em modo partilhado, substitui a copia local se outro worker a alterou."""
+        if not self.shared:
+            return
+
+        current = self.backend.version(entry.session_id)
+
+        if current is None:
+            self.delete(entry.session_id)
+            raise KeyError(f"Sessao desconhecida: {entry.session_id}")
+
+        if current != entry.version:
+            loaded = self.backend.load(entry.session_id)
+            if loaded is None:
+                self.delete(entry.session_id)
+                raise KeyError(f"Sessao desconhecida: {entry.session_id}")
+            entry.messages[:], entry.version = loaded
+
+        entry.messages.mark()
+
+    def _commit(self, entry: SessionEntry) -> None:
+        """
+        Grava o historico com concorrencia otimista.
+
+        Se outro worker gravou a mesma sessao entretanto, as mensagens novas
+        deste turno sao acrescentadas a versao mais recente e tenta-se outra vez.
+        """
+        if not self.shared:
+            return
+
+        added = list(entry.messages.added)
+
+        for _ in range(self.MAX_SAVE_ATTEMPTS):
+            try:
+                entry.version = self.backend.save(entry.session_id, entry.messages, entry.version)
+                return
+            except SessionConflictError:
+                loaded = self.backend.load(entry.session_id)
+                if loaded is None:
+                    return
+
+                latest, version = loaded
+                if latest and entry.messages and entry.messages[0].get("role") == "system":
+                    latest[0] = entry.messages[0]
+                entry.messages[:] = latest + added
+                entry.version = version
+
+        raise SessionConflictError(f"Sessao alterada em paralelo: {entry.session_id}")
+
+    def _evict_locked(self) -> list:
+        """
+        Retira da memoria as sessoes a mais, expiradas ou acima de max_bytes.
+
+        So altera os dicionarios; devolve (session_id, copia do historico)
+        de cada sessao retirada, para _persist gravar depois de largar o lock.
+        """
+        now = time.time()
+        victims = []
+
+        # As entradas estao por ordem de utilizacao: as mais antigas primeiro.
+        for entry in list(self._entries.values()):
+            over_limit = (
+                len(self._entries) - len(victims) > self.max_sessions
+                or self._bytes > self.max_bytes
+            )
+            expired = now - entry.last_used > self.idle_ttl
+
+            if not over_limit and not expired:
+                break
+
+            if entry.pins > 0:
+                continue
+
+            victims.append(entry)
+            self._bytes -= entry.size
+
+        evicted = []
+        for entry in victims:
+            del self._entries[entry.session_id]
+            snapshot = list(entry.messages)
+            self._evicting[entry.session_id] = (entry, snapshot)
+            evicted.append((entry.session_id, snapshot))
+
+        return evicted
+
+    def _persist(self, victims: list) -> None:
+        """Grava as sessoes retiradas da memoria e apaga as antigas do backend."""
+        if not victims:
+            return
+
+        with self._persist_lock:
+            for session_id, snapshot in victims:
+                with self._lock:
+                    pending = self._evicting.get(session_id)
+
+                # Se a sessao voltou para memoria (ou foi retirada outra vez,
+                # com uma copia mais recente) esta copia ja nao e gravada.
+                if pending is None or pending[1] is not snapshot:
+                    continue
+
+                # Em modo partilhado o backend ja tem a versao mais recente.
+                if not self.shared:
+                    self.backend.save(session_id, snapshot, None)
+
+                with self._lock:
+                    if self._evicting.get(session_id) is pending:
+                        del self._evicting[session_id]
+
+            self.backend.purge(time.time() - self.backend_ttl)
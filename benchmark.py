@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Benchmarks locais do assistente Jarvis.
+
+Salvo indicacao em contrario, nao precisam do Ollama: as chamadas ao LLM
+sao simuladas com uma latencia fixa. A memoria usa sempre uma base de
+dados temporaria.
+
+Uso:
+    python benchmark.py sessions --latency 0.2 --turns 5
+    python benchmark.py routing --iterations 20000
+    python benchmark.py prompt-eval --turns 12      (precisa do Ollama)
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _use_temp_db():
+    import memory.user_memory as user_memory
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    user_memory.DB_FILE = path
+    return path
+
+
+def bench_sessions(args):
+    """Mede o throughput do chat com varias sessoes em simultaneo."""
+    import assistant.service as service
+
+    _use_temp_db()
+
+    def fake_llm(messages, tools=None):
+        time.sleep(args.latency)
+        return "Resposta simulada."
+
+    service.call_llm = fake_llm
+    assistant = service.AssistantService(enable_desktop_tools=False)
+
+    print(f"\nLatencia simulada do LLM: {args.latency * 1000:.0f} ms | {args.turns} mensagens por sessao\n")
+    print(f"{'sessoes':>8} {'mensagens':>10} {'tempo (s)':>10} {'msg/s':>8}")
+    print("-" * 40)
+
+    for concurrency in args.concurrency:
+        session_ids = [assistant.create_session()["session_id"] for _ in range(concurrency)]
+
+        def run_session(session_id):
+            for _ in range(args.turns):
+                assistant.chat(session_id, "conta uma piada")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run_session, session_ids))
+        elapsed = time.perf_counter() - start
+
+        total = concurrency * args.turns
+        print(f"{concurrency:>8} {total:>10} {elapsed:>10.2f} {total / elapsed:>8.1f}")
+
+        for session_id in session_ids:
+            assistant.delete_session(session_id)
+
+    print()
+
+
+ROUTING_SAMPLES = (
+    "Que horas sao?",
+    "Qual e a data de hoje?",
+    "Fecha a janela",
+    "Aumenta o volume por favor",
+    "Mostra as minhas preferencias em tabela",
+    "Remover preferencia 3",
+    "Como vai estar o tempo amanha no Porto?",
+    "Conta-me uma piada sobre programadores",
+    "Qual e a capital da Australia e quantos habitantes tem?",
+    "Sempre que eu te perguntar o tempo quero que me digas o tempo nas Caldas da Rainha",
+)
+
+
+def bench_routing(args):
+    """Mede o custo de encaminhar uma mensagem pelas intencoes rapidas."""
+    from assistant.service import intent_router, normalize_text
+
+    samples = [normalize_text(sample) for sample in ROUTING_SAMPLES]
+    intent_router.route(samples[0])
+
+    print(f"\n{len(intent_router.intents)} intencoes registadas | {args.iterations} iteracoes por mensagem\n")
+    print(f"{'intencao':>18} {'us/msg':>8}  mensagem")
+    print("-" * 70)
+
+    for sample in samples:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            routed = intent_router.route(sample)
+        elapsed = time.perf_counter() - start
+
+        name = routed.name if routed else "-"
+        print(f"{name:>18} {elapsed / args.iterations * 1e6:>8.2f}  {sample[:40]}")
+
+    print()
+
+
+PROMPT_EVAL_QUESTIONS = (
+    "Ola, como estas?",
+    "Explica-me em duas frases o que e a fotossintese.",
+    "E porque e que as folhas sao verdes?",
+    "Da-me uma ideia para o jantar de hoje.",
+    "Qual e a diferenca entre um virus e uma bacteria?",
+    "Conta-me uma curiosidade sobre Portugal.",
+)
+
+
+def bench_prompt_eval(args):
+    """
+    Compara o tempo de avaliacao do prompt por turno no Ollama.
+
+    "antes": memoria no meio do system prompt, tools descritas em texto,
+    sem pesquisa de memorias e historico cortado um turno de cada vez.
+    "depois": as opcoes do config.py (PROMPT_CACHE_FRIENDLY,
+    OLLAMA_NATIVE_TOOLS, MEMORY_RETRIEVAL) e corte em blocos, como num
+    turno real do AssistantService.
+    """
+    import statistics
+
+    import requests
+
+    import prompts.system_prompt as system_prompt
+    from assistant.history import trim_history
+    from config import (
+        HISTORY_TRIM_BLOCK,
+        MEMORY_RETRIEVAL,
+        MODEL,
+        OLLAMA_NATIVE_TOOLS,
+        OLLAMA_URL,
+        PROMPT_CACHE_FRIENDLY,
+    )
+    from llm.ollama import _build_payload
+    from memory.user_memory import init_db, save_preference
+    from memory.vectors import relevant_memories
+    from tools.registry import TOOLS
+
+    _use_temp_db()
+    init_db()
+
+    # (cenario, cache_friendly, native_tools, retrieval, block_turns)
+    scenarios = (
+        ("antes", False, False, False, 1),
+        ("depois", PROMPT_CACHE_FRIENDLY, OLLAMA_NATIVE_TOOLS, MEMORY_RETRIEVAL, HISTORY_TRIM_BLOCK),
+    )
+
+    print(f"\nModelo: {MODEL} | {args.turns} turnos | memoria alterada a cada {args.memory_every} turnos\n")
+    print(f"{'cenario':>8} {'tokens/turno':>13} {'media (ms)':>11} {'mediana (ms)':>13}")
+    print("-" * 50)
+
+    for label, cache_friendly, native_tools, retrieval, block_turns in scenarios:
+        system_prompt.PROMPT_CACHE_FRIENDLY = cache_friendly
+        system_prompt.OLLAMA_NATIVE_TOOLS = native_tools
+        system_prompt.MEMORY_RETRIEVAL = retrieval
+        tools = TOOLS if native_tools else None
+        messages = [{"role": "system", "content": system_prompt.build_system_prompt()}]
+        durations = []
+        tokens = []
+
+        for turn in range(args.turns):
+            if args.memory_every and turn and turn % args.memory_every == 0:
+                save_preference(f"Preferencia de teste numero {turn} ({label}).")
+                messages[0]["content"] = system_prompt.build_system_prompt()
+
+            question = PROMPT_EVAL_QUESTIONS[turn % len(PROMPT_EVAL_QUESTIONS)]
+            if retrieval:
+                question = system_prompt.build_memory_context(relevant_memories(question)) + question
+            messages.append({"role": "user", "content": question})
+
+            payload = _build_payload(messages, tools=tools)
+            payload["options"]["num_predict"] = args.max_tokens
+            response = requests.post(f"{OLLAMA_URL}/api/chat", json=payload, timeout=300)
+            response.raise_for_status()
+            data = response.json()
+
+            # O primeiro turno inclui o carregamento do modelo e fica de fora.
+            if turn:
+                durations.append(data.get("prompt_eval_duration", 0) / 1e6)
+                tokens.append(data.get("prompt_eval_count", 0))
+
+            messages.append({"role": "assistant", "content": data["message"]["content"]})
+            trim_history(messages, budget=args.budget, block_turns=block_turns)
+
+        print(
+            f"{label:>8} {statistics.mean(tokens):>13.0f} "
+            f"{statistics.mean(durations):>11.0f} {statistics.median(durations):>13.0f}"
+        )
+
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks locais do Jarvis.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sessions = subparsers.add_parser("sessions", help="Throughput com sessoes concorrentes.")
+    sessions.add_argument("--latency", type=float, default=0.2, help="Latencia simulada do LLM em segundos.")
+    sessions.add_argument("--turns", type=int, default=5, help="Mensagens enviadas por sessao.")
+    sessions.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    sessions.set_defaults(func=bench_sessions)
+
+    routing = subparsers.add_parser("routing", help="Custo do encaminhamento de intencoes.")
+    routing.add_argument("--iterations", type=int, default=20000)
+    routing.set_defaults(func=bench_routing)
+
+    prompt_eval = subparsers.add_parser("prompt-eval", help="Tempo de avaliacao do prompt no Ollama.")
+    prompt_eval.add_argument("--turns", type=int, default=12)
+    prompt_eval.add_argument("--memory-every", type=int, default=4, help="Altera a memoria a cada N turnos (0 desliga).")
+    prompt_eval.add_argument("--max-tokens", type=int, default=48, help="Tokens gerados por resposta.")
+    prompt_eval.add_argument("--budget", type=int, default=1500, help="Orcamento de tokens do historico.")
+    prompt_eval.set_defaults(func=bench_prompt_eval)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,22 +8,118 @@ Qualquer valor que possa mudar entre ambientes
 (dev, prod, máquina diferente) deve viver aqui.
 """
 
+import os
+
 # Endereço do servidor Ollama (LLM local)
 OLLAMA_URL = "http://127.0.0.1:11434"
 
+# Instancias Ollama pelas quais os pedidos sao distribuidos (ver llm/pool.py)
+OLLAMA_URLS = [OLLAMA_URL]
+
+# Intervalo (segundos) entre health checks das instancias Ollama
+OLLAMA_HEALTH_INTERVAL = 10
+
+# Segundos sem resposta ate repetir o pedido noutra instancia (None desativa)
+OLLAMA_HEDGE_AFTER = None
+
+# Pedidos em simultaneo por instancia Ollama (alinhar com OLLAMA_NUM_PARALLEL)
+OLLAMA_MAX_IN_FLIGHT = 4
+
+# Pedidos que podem esperar por um lugar livre e tempo maximo de espera
+# (segundos); acima disso o pedido e recusado com 503 + Retry-After
+LLM_QUEUE_SIZE = 16
+LLM_QUEUE_TIMEOUT = 15
+
+# Circuit breakers (net/breaker.py): falhas seguidas que marcam um servico
+# como indisponivel e segundos ate voltar a tentar
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_RESET_TIMEOUT = 30
+
 # Modelo LLM a usar
 MODEL = "llama3.1:8b"
 
+# Ligacoes HTTP de saida, por servico: timeouts (segundos) e tamanho do
+# pool de ligacoes keep-alive reutilizadas entre pedidos
+HTTP_BACKENDS = {
+    "ollama": {"connect_timeout": 5, "read_timeout": 60, "pool_size": 32},
+    "open_meteo": {"connect_timeout": 3, "read_timeout": 10, "pool_size": 8},
+    "search": {"connect_timeout": 3, "read_timeout": 10, "pool_size": 8},
+}
+
+# Tempo que o Ollama mantem o modelo (e a cache KV) carregado entre pedidos
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Envia as tools no campo "tools" da API do Ollama (tool calls estruturados)
+# em vez de as descrever no system prompt; requer um modelo com suporte a tools
+OLLAMA_NATIVE_TOOLS = True
+
+# Ordena o system prompt do mais estavel (persona, tools) para o menos
+# estavel (memoria), para maximizar o prefixo reutilizado pelo Ollama
+PROMPT_CACHE_FRIENDLY = True
+
 
 # Configuração de áudio
 # Whisper funciona melhor a 16 kHz
 SAMPLE_RATE = 16000
 
-# Histórico de conversa (perguntas + respostas)
-MAX_TURNS = 6
+# Janela de contexto pedida ao Ollama (tokens)
+NUM_CTX = 8192
+
+# Histórico de conversa (system prompt + perguntas + respostas), em tokens
+# estimados; o resto de NUM_CTX fica para a resposta do modelo
+HISTORY_TOKEN_BUDGET = NUM_CTX - 1536
+
+# Turnos descartados de uma vez quando o histórico excede o orçamento
+HISTORY_TRIM_BLOCK = 3
+
+# Limites das sessoes em memoria; as excedentes ficam apenas em SESSION_DB
+SESSION_MAX_COUNT = 1000
+SESSION_MAX_BYTES = 64 * 1024 * 1024
+SESSION_IDLE_TTL = 30 * 60          # segundos sem uso ate sair da memoria
+SESSION_DB_TTL = 7 * 24 * 3600      # sessoes guardadas sem uso sao apagadas
+SESSION_DB = "sessions.db"
+
+# Com varios workers do servidor, SESSION_DB passa a ser a fonte de verdade
+# das sessoes (definido automaticamente por main.py --workers N > 1)
+SESSION_SHARED = os.environ.get("JARVIS_SHARED_SESSIONS") == "1"
+
+# Cache de respostas a perguntas sem historico (assistant/response_cache.py),
+# desligada por omissao: respostas criativas passam a repetir-se
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_DB = "response_cache.db"
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+RESPONSE_CACHE_TTL = 24 * 3600
+RESPONSE_CACHE_MAX_REPLY_CHARS = 4000
+
+# Mantem em cache a previsao do tempo das cidades conhecidas (tools/weather.py)
+WEATHER_PREFETCH = True
+
+# Cache da pesquisa web: duracao (segundos), numero de pesquisas guardadas
+# e tokens maximos (estimados) dos resultados enviados ao LLM
+SEARCH_CACHE_TTL = 15 * 60
+SEARCH_CACHE_MAX_ENTRIES = 256
+SEARCH_RESULT_TOKENS = 600
+
+# Tools executadas em simultaneo (varios tool calls no mesmo turno)
+TOOL_MAX_WORKERS = 8
 
 # Base de dados local para memória persistente
 DB_FILE = "memory.db"
 
+# Em vez de todas as preferências e lembretes, o prompt leva só os mais
+# relevantes para a mensagem (pesquisa FTS5/BM25): no máximo MEMORY_TOP_K
+# entradas e MEMORY_TOKEN_BUDGET tokens estimados. O nome vai sempre.
+MEMORY_RETRIEVAL = True
+MEMORY_TOP_K = 5
+MEMORY_TOKEN_BUDGET = 256
+
+# Pesquisa semântica da memória (memory/vectors.py): "ollama" calcula os
+# embeddings com EMBED_MODEL, "hash" usa um embedding determinístico local
+# (testes, máquinas sem o modelo) e None fica só a pesquisa por palavras.
+# Abaixo de MEMORY_MIN_SIMILARITY (cosseno) uma memória não é relevante.
+MEMORY_EMBEDDINGS = "ollama"
+EMBED_MODEL = "nomic-embed-text"
+MEMORY_MIN_SIMILARITY = 0.5
+
 # Flag global usada para interromper o TTS (barge-in)
 STOP_TTS = False
\ No newline at end of file
@@ -4,47 +4,289 @@ Comunicacao com o LLM (Ollama).
 Responsabilidade unica:
 - Enviar mensagens ao Ollama
 - Receber a resposta do modelo
+
+Os pedidos passam pelo pool de instancias de OLLAMA_URLS (llm/pool.py),
+que escolhe a instancia e repete o pedido noutra se esta falhar.
+
+Quando recebem tools, as funcoes enviam-nas no campo "tools" da API e os
+tool calls estruturados do modelo sao devolvidos como o texto JSON
+{"type": "tool_call", ...} que o resto do assistente ja sabe tratar.
 """
 
+import json
+from threading import Lock
+
+import httpx
 import requests
 
-from config import MODEL, OLLAMA_URL
+from config import (
+    EMBED_MODEL,
+    LLM_QUEUE_SIZE,
+    LLM_QUEUE_TIMEOUT,
+    MODEL,
+    NUM_CTX,
+    OLLAMA_HEALTH_INTERVAL,
+    OLLAMA_HEDGE_AFTER,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_MAX_IN_FLIGHT,
+    OLLAMA_URLS,
+)
+from llm.pool import BackendPool, PoolOverloadedError
+from net import clients
+from net.breaker import CircuitOpenError
+from tools.registry import ollama_tool_schemas
+
+# Timeout (connect, read) do health check de cada instancia
+HEALTH_CHECK_TIMEOUT = (2, 2)
+
+_pool = None
+_pool_lock = Lock()
 
 
 class LLMUnavailableError(RuntimeError):
     """Erro levantado quando o Ollama nao esta acessivel."""
 
 
-def call_llm(messages):
-    """
-    Envia a conversa ao Ollama e devolve a resposta do modelo.
-    """
+class LLMOverloadedError(LLMUnavailableError):
+    """O Ollama esta no limite de pedidos; retry_after indica quando tentar de novo."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'O Ollama esta sobrecarregado. Tenta de novo dentro de {retry_after} segundos.')
+        self.retry_after = retry_after
+
+
+def _build_payload(messages, stream=False, tools=None):
     payload = {
         'model': MODEL,
         'messages': messages,
-        'stream': False,
+        'stream': stream,
+        'keep_alive': OLLAMA_KEEP_ALIVE,
         'options': {
             'temperature': 0.7,
             'top_p': 0.9,
+            'num_ctx': NUM_CTX,
         },
     }
 
-    try:
-        response = requests.post(
-            f'{OLLAMA_URL}/api/chat',
-            json=payload,
-            timeout=60,
-        )
-        response.raise_for_status()
-    except requests.RequestException as exc:
-        raise LLMUnavailableError(
-            f'Ollama indisponivel em {OLLAMA_URL}. Inicia o servidor Ollama e confirma que o modelo "{MODEL}" esta carregado.'
-        ) from exc
+    if tools:
+        payload['tools'] = ollama_tool_schemas(tools)
+
+    return payload
+
+
+def _check_backend(url):
+    """Health check: a instancia responde e lista modelos."""
+    response = clients.get_session('ollama').get(f'{url}/api/tags', timeout=HEALTH_CHECK_TIMEOUT)
+    return response.ok
+
+
+def get_pool():
+    """Devolve o pool de instancias Ollama, criado no primeiro uso."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = BackendPool(
+                    OLLAMA_URLS,
+                    health_check=_check_backend,
+                    hedge_after=OLLAMA_HEDGE_AFTER,
+                    max_in_flight=OLLAMA_MAX_IN_FLIGHT,
+                    max_queue=LLM_QUEUE_SIZE,
+                    queue_timeout=LLM_QUEUE_TIMEOUT,
+                )
+                pool.start_health_checks(OLLAMA_HEALTH_INTERVAL)
+                _pool = pool
+
+    return _pool
 
+
+def _unavailable_error():
+    urls = ', '.join(OLLAMA_URLS)
+    return LLMUnavailableError(
+        f'Ollama indisponivel em {urls}. Inicia o servidor Ollama e confirma que o modelo "{MODEL}" esta carregado.'
+    )
+
+
+def _tool_call_text(message):
+    """
+    Converte os tool calls nativos da mensagem no JSON de tool call do assistente.
+
+    Um tool call da um objeto; varios dao uma lista de objetos.
+    """
+    tool_calls = message.get('tool_calls') or []
+    if not tool_calls:
+        return None
+
+    calls = []
+    for tool_call in tool_calls:
+        function = tool_call.get('function') or {}
+        calls.append({
+            'type': 'tool_call',
+            'tool_name': function.get('name'),
+            'arguments': function.get('arguments') or {},
+        })
+
+    return json.dumps(calls[0] if len(calls) == 1 else calls, ensure_ascii=False)
+
+
+def _parse_reply(response):
     try:
-        data = response.json()
-        reply = data['message']['content'].strip()
-    except (ValueError, KeyError, TypeError) as exc:
+        message = response.json()['message']
+        tool_call = _tool_call_text(message)
+        if tool_call is not None:
+            return tool_call
+        return message['content'].strip()
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
         raise LLMUnavailableError('O Ollama respondeu num formato inesperado.') from exc
 
-    return reply
\ No newline at end of file
+
+def call_llm(messages, tools=None):
+    """
+    Envia a conversa ao Ollama e devolve a resposta do modelo.
+
+    Com tools, o modelo pode responder com um tool call (ver _tool_call_text).
+    """
+    payload = _build_payload(messages, tools=tools)
+
+    def send(url):
+        response = clients.request('ollama', 'POST', f'{url}/api/chat', json=payload)
+        return _parse_reply(response)
+
+    try:
+        return get_pool().call(send)
+    except PoolOverloadedError as exc:
+        raise LLMOverloadedError(exc.retry_after) from exc
+    except (requests.RequestException, CircuitOpenError) as exc:
+        raise _unavailable_error() from exc
+
+
+def embed_texts(texts):
+    """
+    Devolve os embeddings (EMBED_MODEL) dos textos, pela mesma ordem.
+
+    Nao passa pelo pool: um modelo de embeddings em falta nao deve abrir
+    os circuit breakers usados pelo chat. Tenta as instancias por ordem.
+    """
+    payload = {'model': EMBED_MODEL, 'input': list(texts), 'keep_alive': OLLAMA_KEEP_ALIVE}
+    last_error = None
+
+    for url in OLLAMA_URLS:
+        try:
+            response = clients.request('ollama', 'POST', f'{url}/api/embed', json=payload)
+            return response.json()['embeddings']
+        except (requests.RequestException, ValueError, KeyError) as exc:
+            last_error = exc
+
+    raise _embed_error() from last_error
+
+
+async def aembed_texts(texts):
+    """
+    Versao assincrona de embed_texts.
+    """
+    payload = {'model': EMBED_MODEL, 'input': list(texts), 'keep_alive': OLLAMA_KEEP_ALIVE}
+    last_error = None
+
+    for url in OLLAMA_URLS:
+        try:
+            response = await clients.arequest('ollama', 'POST', f'{url}/api/embed', json=payload)
+            return response.json()['embeddings']
+        except (httpx.HTTPError, ValueError, KeyError) as exc:
+            last_error = exc
+
+    raise _embed_error() from last_error
+
+
+def _embed_error():
+    return LLMUnavailableError(
+        f'Nao foi possivel calcular embeddings. Confirma que o modelo "{EMBED_MODEL}" esta instalado no Ollama.'
+    )
+
+
+async def acall_llm(messages, tools=None):
+    """
+    Versao assincrona de call_llm.
+    """
+    payload = _build_payload(messages, tools=tools)
+
+    async def send(url):
+        response = await clients.arequest('ollama', 'POST', f'{url}/api/chat', json=payload)
+        return _parse_reply(response)
+
+    try:
+        return await get_pool().acall(send)
+    except PoolOverloadedError as exc:
+        raise LLMOverloadedError(exc.retry_after) from exc
+    except (httpx.HTTPError, CircuitOpenError) as exc:
+        raise _unavailable_error() from exc
+
+
+async def astream_llm(messages, tools=None):
+    """
+    Envia a conversa ao Ollama em modo streaming.
+
+    Gerador assincrono que devolve os pedacos de texto a medida que o
+    modelo os produz, para reduzir o tempo ate ao primeiro token. Se uma
+    instancia falhar antes do primeiro pedaco, tenta a seguinte; depois
+    disso o erro e propagado, porque parte da resposta ja foi enviada.
+    """
+    pool = get_pool()
+    payload = _build_payload(messages, stream=True, tools=tools)
+    tried = set()
+    last_error = None
+
+    while True:
+        try:
+            backend = await pool.aacquire(exclude=tried)
+        except PoolOverloadedError as exc:
+            raise LLMOverloadedError(exc.retry_after) from exc
+        except CircuitOpenError as exc:
+            raise _unavailable_error() from exc
+
+        if backend is None:
+            raise _unavailable_error() from last_error
+
+        tried.add(backend)
+        started = False
+
+        chunks = _astream_from(backend.url, payload)
+
+        try:
+            with pool.using(backend):
+                async for token in chunks:
+                    started = True
+                    yield token
+            return
+        except (httpx.HTTPError, LLMUnavailableError) as exc:
+            if started:
+                if isinstance(exc, LLMUnavailableError):
+                    raise
+                raise _unavailable_error() from exc
+            last_error = exc
+        finally:
+            # Se quem le parar a meio, fecha ja a ligacao e o Ollama para de gerar.
+            await chunks.aclose()
+
+
+async def _astream_from(url, payload):
+    async with clients.astream('ollama', 'POST', f'{url}/api/chat', json=payload) as response:
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+
+            try:
+                data = json.loads(line)
+            except ValueError as exc:
+                raise LLMUnavailableError('O Ollama respondeu num formato inesperado.') from exc
+
+            if 'error' in data:
+                raise LLMUnavailableError(f'Erro do Ollama: {data["error"]}')
+
+            message = data.get('message') or {}
+            token = _tool_call_text(message) or message.get('content') or ''
+            if token:
+                yield token
+
+            if data.get('done'):
+                break
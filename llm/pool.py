@@ -0,0 +1,452 @@
+"""
+Pool de instancias Ollama.
+
+Distribui os pedidos pela instancia com menos pedidos em curso, tira de
+rotacao as instancias cujo circuit breaker esta aberto (net/breaker.py)
+e, opcionalmente, duplica um pedido lento para uma segunda
+instancia (hedging), ficando com a primeira resposta.
+
+Cada instancia aceita no maximo max_in_flight pedidos em simultaneo. Os
+restantes esperam numa fila limitada; com a fila cheia, ou depois de
+queue_timeout segundos de espera, o pedido e recusado logo com
+PoolOverloadedError em vez de ficar preso ate ao timeout do Ollama.
+
+O pool nao sabe falar com o Ollama: recebe funcoes fn(url) que fazem o
+pedido propriamente dito (ver llm/ollama.py).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from net.breaker import CLOSED, OPEN, get_breaker
+
+
+class PoolOverloadedError(RuntimeError):
+    """Todas as instancias estao ocupadas e a fila de espera esta cheia."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Pool sobrecarregado; tentar de novo dentro de {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class _AsyncWaiter:
+    """Pedido assincrono em fila; pode ser acordado a partir de qualquer thread."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = None
+
+    def reset(self):
+        self.future = self.loop.create_future()
+
+    def __call__(self):
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self.future is not None and not self.future.done():
+            self.future.set_result(None)
+
+
+class Backend:
+    """Uma instancia Ollama e o seu estado no pool."""
+
+    def __init__(self, url: str, name: str):
+        self.url = url.rstrip("/")
+        self.breaker = get_breaker(f"{name} {self.url}")
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.avg_latency = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state != OPEN
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_latency_ms": round(self.avg_latency * 1000, 1) if self.avg_latency is not None else None,
+        }
+
+
+class BackendPool:
+    """
+    Encaminhamento por menor numero de pedidos em curso, com failover.
+
+    health_check(url) -> bool e chamado periodicamente numa thread de fundo
+    (start_health_checks). hedge_after, em segundos, ativa o hedging. Os
+    breakers das instancias chamam-se "<name> <url>".
+    """
+
+    def __init__(
+        self,
+        urls,
+        name: str = "ollama",
+        health_check=None,
+        hedge_after: float | None = None,
+        max_in_flight: int = 4,
+        max_queue: int = 16,
+        queue_timeout: float = 15,
+    ):
+        if not urls:
+            raise ValueError("O pool precisa de pelo menos uma instancia.")
+
+        self.backends = [Backend(url, name) for url in urls]
+        self.health_check = health_check
+        self.hedge_after = hedge_after
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.hedged_requests = 0
+        self.queued_requests = 0
+        self.rejected_requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._health_thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backends": [backend.stats() for backend in self.backends],
+                "hedge_after": self.hedge_after,
+                "hedged_requests": self.hedged_requests,
+                "max_in_flight": self.max_in_flight,
+                "queue_depth": len(self._waiters),
+                "max_queue": self.max_queue,
+                "queued_requests": self.queued_requests,
+                "rejected_requests": self.rejected_requests,
+                "avg_wait_ms": round(self.total_wait / self.queued_requests * 1000, 1) if self.queued_requests else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+            }
+
+    def _reserve_locked(self, exclude, queued: bool, optional: bool = False) -> tuple[Backend | None, bool]:
+        """
+        Tenta reservar um lugar numa instancia. Devolve (instancia, bloqueado).
+
+        Escolhe a instancia com menos pedidos em curso, preferindo as de
+        breaker fechado. Se todos os breakers estiverem abertos levanta
+        CircuitOpenError de imediato, exceto com optional (ex: hedging),
+        em que devolve (None, False). Pedidos novos nao passam a frente dos
+        que ja estao na fila.
+        """
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            return None, False
+
+        if self._waiters and not queued:
+            return None, True
+
+        usable = [backend for backend in candidates if backend.breaker.available()]
+        if not usable:
+            if optional:
+                return None, False
+            raise min(candidates, key=lambda backend: backend.breaker.retry_after()).breaker.open_error()
+
+        free = [backend for backend in usable if backend.outstanding < self.max_in_flight]
+        if not free:
+            return None, True
+
+        backend = min(free, key=lambda backend: (backend.breaker.state != CLOSED, backend.outstanding))
+        backend.breaker.allow()
+        backend.outstanding += 1
+        backend.requests += 1
+        return backend, False
+
+    def _admit_locked(self, started: float, queued: bool):
+        """Decide se um pedido bloqueado pode (continuar a) esperar na fila."""
+        remaining = started + self.queue_timeout - time.perf_counter()
+
+        if remaining <= 0 or (not queued and len(self._waiters) >= self.max_queue):
+            self.rejected_requests += 1
+            raise PoolOverloadedError(self._retry_after_locked())
+
+        return remaining
+
+    def _record_wait_locked(self, waited: float):
+        self.queued_requests += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _retry_after_locked(self) -> int:
+        """Estimativa (segundos) de quando a fila atual estara despachada."""
+        latencies = [backend.avg_latency for backend in self.backends if backend.avg_latency]
+        latency = sum(latencies) / len(latencies) if latencies else 1.0
+        capacity = self.max_in_flight * len(self.backends)
+        return max(1, math.ceil(latency * (len(self._waiters) + 1) / capacity))
+
+    def acquire(self, exclude=(), wait: bool = True) -> Backend | None:
+        """
+        Reserva um lugar numa instancia fora de exclude.
+
+        Devolve None se nao houver instancias por tentar ou, com wait=False,
+        se estiverem todas ocupadas ou em baixo. Com wait=True espera na fila
+        e levanta PoolOverloadedError se a fila estiver cheia ou a espera
+        expirar, ou CircuitOpenError se todas as instancias estiverem em baixo.
+        O lugar e libertado no fim do bloco using(backend).
+        """
+        started = time.perf_counter()
+        event = None
+
+        try:
+            while True:
+                with self._lock:
+                    if event is not None:
+                        event.clear()
+
+                    backend, blocked = self._reserve_locked(exclude, queued=event is not None, optional=not wait)
+                    if not blocked:
+                        if event is not None:
+                            self._record_wait_locked(time.perf_counter() - started)
+                        return backend
+
+                    if not wait:
+                        return None
+
+                    remaining = self._admit_locked(started, queued=event is not None)
+                    if event is None:
+                        event = threading.Event()
+                        self._waiters.append(event.set)
+
+                event.wait(remaining)
+        finally:
+            if event is not None:
+                self._remove_waiter(event.set)
+
+    async def aacquire(self, exclude=()) -> Backend | None:
+        """Versao assincrona de acquire: a espera na fila nao bloqueia o event loop."""
+        started = time.perf_counter()
+        waiter = None
+
+        try:
+            while True:
+                with self._lock:
+                    backend, blocked = self._reserve_locked(exclude, queued=waiter is not None)
+                    if not blocked:
+                        if waiter is not None:
+                            self._record_wait_locked(time.perf_counter() - started)
+                        return backend
+
+                    remaining = self._admit_locked(started, queued=waiter is not None)
+                    if waiter is None:
+                        waiter = _AsyncWaiter(asyncio.get_running_loop())
+                        self._waiters.append(waiter)
+                    waiter.reset()
+
+                try:
+                    await asyncio.wait_for(waiter.future, remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if waiter is not None:
+                self._remove_waiter(waiter)
+
+    def _remove_waiter(self, waiter):
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _release(self, backend: Backend):
+        with self._lock:
+            backend.outstanding -= 1
+            waiters = list(self._waiters)
+
+        # Acorda toda a fila: cada pedido pode excluir instancias diferentes,
+        # por isso nao se sabe qual deles consegue usar o lugar libertado.
+        for wake in waiters:
+            wake()
+
+    @contextmanager
+    def using(self, backend: Backend):
+        """
+        Usa o lugar reservado por acquire em backend.
+
+        Atualiza a saude da instancia e liberta o lugar no fim.
+        """
+        started = time.perf_counter()
+
+        try:
+            yield backend
+        except Exception:
+            backend.breaker.record_failure()
+            with self._lock:
+                backend.failures += 1
+            raise
+        except GeneratorExit:
+            # Quem lia o stream parou (ex: tool call completo): a instancia respondeu bem.
+            backend.breaker.record_success()
+            raise
+        except BaseException:
+            # Um pedido cancelado (ex: perdeu o hedging) nao e uma falha.
+            backend.breaker.record_cancelled()
+            raise
+        else:
+            backend.breaker.record_success()
+            self._record_latency(backend, time.perf_counter() - started)
+        finally:
+            self._release(backend)
+
+    def _record_latency(self, backend: Backend, elapsed: float):
+        with self._lock:
+            if backend.avg_latency is None:
+                backend.avg_latency = elapsed
+            else:
+                backend.avg_latency = 0.8 * backend.avg_latency + 0.2 * elapsed
+
+    def _run(self, backend: Backend, fn):
+        with self.using(backend):
+            return fn(backend.url)
+
+    def call(self, fn):
+        """
+        Executa fn(url) numa instancia, com failover para as restantes.
+
+        Levanta a ultima excecao se todas as instancias falharem.
+        """
+        tried = set()
+        last_error = None
+
+        while True:
+            backend = self.acquire(exclude=tried)
+            if backend is None:
+                raise last_error
+
+            tried.add(backend)
+            try:
+                if self.hedge_after is not None and len(self.backends) > 1:
+                    return self._call_hedged(fn, backend, tried)
+                return self._run(backend, fn)
+            except Exception as exc:
+                last_error = exc
+
+    def _call_hedged(self, fn, primary: Backend, tried: set):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+
+        pending = {self._executor.submit(self._run, primary, fn)}
+        done, pending = wait(pending, timeout=self.hedge_after)
+
+        if not done:
+            secondary = self.acquire(exclude=tried, wait=False)
+            if secondary is not None:
+                tried.add(secondary)
+                with self._lock:
+                    self.hedged_requests += 1
+                pending.add(self._executor.submit(self._run, secondary, fn))
+
+        # O pedido que perde continua em fundo: nao e possivel cancelar
+        # um pedido sincrono a meio.
+        last_error = None
+        while done or pending:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                last_error = future.exception()
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        raise last_error
+
+    async def acall(self, afn):
+        """Versao assincrona de call: afn(url) e uma coroutine function."""
+        tried = set()
+        last_error = None
+
+        while True:
+            backend = await self.aacquire(exclude=tried)
+            if backend is None:
+                raise last_error
+
+            tried.add(backend)
+            try:
+                if self.hedge_after is not None and len(self.backends) > 1:
+                    return await self._acall_hedged(afn, backend, tried)
+                return await self._arun(backend, afn)
+            except Exception as exc:
+                last_error = exc
+
+    async def _arun(self, backend: Backend, afn):
+        with self.using(backend):
+            return await afn(backend.url)
+
+    async def _acall_hedged(self, afn, primary: Backend, tried: set):
+        pending = {asyncio.ensure_future(self._arun(primary, afn))}
+        done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+
+        if not done:
+            secondary = self.acquire(exclude=tried, wait=False)
+            if secondary is not None:
+                tried.add(secondary)
+                with self._lock:
+                    self.hedged_requests += 1
+                pending.add(asyncio.ensure_future(self._arun(secondary, afn)))
+
+        last_error = None
+        try:
+            while done or pending:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Cancelar o pedido mais lento fecha a ligacao e o Ollama para a geracao.
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    def check_health(self):
+        """
+        Confirma o estado de todas as instancias com health_check(url).
+
+        Uma instancia que responde passa a aceitar um pedido de teste (o
+        breaker fecha se correr bem); uma que nao responde abre o breaker.
+        """
+        if self.health_check is None:
+            return
+
+        for backend in self.backends:
+            try:
+                healthy = bool(self.health_check(backend.url))
+            except Exception:
+                healthy = False
+
+            if healthy:
+                backend.breaker.probe_ok()
+            else:
+                backend.breaker.trip()
+
+    def start_health_checks(self, interval: float):
+        """Arranca (uma vez) a thread de fundo que corre check_health."""
+        if self.health_check is None or self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=loop, name="llm-health", daemon=True)
+        self._health_thread.start()
@@ -0,0 +1,38 @@
+"""
+Estimativa rapida do numero de tokens de um texto.
+
+Nao usa o tokenizer real do modelo: aproxima cada palavra por pedacos de
+ate 4 caracteres e conta cada sinal de pontuacao como um token, o que
+fica perto do tokenizer do llama3 para portugues e ingles. Os resultados
+ficam em cache porque o mesmo texto (system prompt, historico) e medido
+em todos os turnos.
+"""
+
+import re
+from functools import lru_cache
+
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Tokens extra por mensagem (cabecalhos de role do template de chat)
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    return sum(1 for _ in _TOKEN_RE.finditer(text))
+
+
+def estimate_message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD + estimate_tokens(message.get("content") or "")
+
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "...") -> str:
+    """Corta o texto para caber em max_tokens (estimados)."""
+    if max_tokens <= 0:
+        return ""
+
+    for count, match in enumerate(_TOKEN_RE.finditer(text), 1):
+        if count > max_tokens:
+            return text[:match.start()].rstrip() + suffix
+
+    return text
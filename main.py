@@ -1,6 +1,7 @@
 """Ponto de entrada da aplicacao em modo voz local ou modo servidor HTTP."""
 
 import argparse
+import os
 
 from assistant.service import AssistantService
 
@@ -10,8 +11,14 @@ def run_voice_mode():
     from audio.tts import speak
     from audio.wakeword import wait_for_wake_word
 
+    from config import WEATHER_PREFETCH
+    from tools.weather import start_forecast_prefetch
+
     assistant = AssistantService(enable_desktop_tools=True)
     session = assistant.create_session()
+
+    if WEATHER_PREFETCH:
+        start_forecast_prefetch()
     session_id = session["session_id"]
 
     calibrate_noise()
@@ -45,8 +52,16 @@ def run_voice_mode():
             speak(reply)
 
 
-def run_server_mode(host: str, port: int):
+def run_server_mode(host: str, port: int, workers: int = 1):
     import uvicorn
+
+    if workers > 1:
+        # Cada worker e um processo: as sessoes passam a viver so na base de
+        # dados partilhada para que qualquer worker sirva qualquer sessao.
+        os.environ["JARVIS_SHARED_SESSIONS"] = "1"
+        uvicorn.run("api.server:app", host=host, port=port, workers=workers)
+        return
+
     from api.server import app
 
     uvicorn.run(app, host=host, port=port)
@@ -64,10 +79,11 @@ def main():
     )
     parser.add_argument("--host", default="0.0.0.0", help="Host da API no modo server.")
     parser.add_argument("--port", type=int, default=8000, help="Porta da API no modo server.")
+    parser.add_argument("--workers", type=int, default=1, help="Numero de processos da API no modo server.")
     args = parser.parse_args()
 
     if args.mode == "server":
-        run_server_mode(args.host, args.port)
+        run_server_mode(args.host, args.port, args.workers)
         return
 
     run_voice_mode()
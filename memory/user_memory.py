@@ -6,46 +6,108 @@ Responsabilidade:
 - Disponibilizar leitura e gestao desses factos
 
 Nao contem logica de NLP.
+
+Cada entrada tem uma chave (usada pela API), um tipo (fact, preference
+ou reminder) e, nas preferencias e lembretes, um numero sequencial por
+tipo (seq) que forma a chave: preference_1, reminder_3, ...
+
+Os valores ficam tambem num indice FTS5 (user_memory_fts), mantido por
+triggers, usado por search_memory para escolher as memorias relevantes
+para cada mensagem.
 """
 
+import os
+import re
 import sqlite3
+import threading
+import time
+import unicodedata
+from threading import Lock
 
 from config import DB_FILE
 
+_memory_version = 0
+_version_lock = Lock()
+
+# Uma ligacao por thread, aberta no primeiro uso e reutilizada
+_local = threading.local()
+
+
+def _bump_version():
+    global _memory_version
+    with _version_lock:
+        _memory_version += 1
+
+
+def memory_version():
+    """
+    Identifica o estado atual da memoria, para invalidar caches.
+
+    Combina um contador incrementado em cada escrita deste processo com a
+    data de modificacao da base de dados e do ficheiro WAL, que mudam
+    tambem quando outro processo (ex: outro worker do servidor) escreve.
+    Em modo WAL as escritas vao primeiro para o ficheiro -wal, por isso a
+    data da base de dados so muda nos checkpoints.
+    """
+    return _memory_version, _file_version(DB_FILE), _file_version(DB_FILE + "-wal")
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0
+    return stat.st_mtime_ns, stat.st_size
+
 
 def _connect():
-    conn = sqlite3.connect(DB_FILE)
+    """
+    Devolve a ligacao SQLite da thread atual.
+
+    A ligacao fica aberta (com as queries preparadas em cache) e usa WAL:
+    leitores e escritor nao se bloqueiam. synchronous=NORMAL evita um
+    fsync por commit; em WAL continua seguro contra corrupcao.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_FILE:
+        return conn
+
+    if conn is not None:
+        conn.close()
+
+    conn = sqlite3.connect(DB_FILE, timeout=5, cached_statements=128)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn = conn
+    _local.path = DB_FILE
     return conn
 
 
-def _next_index(prefix):
-    conn = _connect()
-    c = conn.cursor()
-    c.execute("SELECT key FROM user_memory WHERE key LIKE ?", (f"{prefix}%",))
-    keys = [row["key"] for row in c.fetchall()]
-    conn.close()
-
-    max_index = 0
+def close_connection():
+    """Fecha a ligacao da thread atual (reaberta no proximo uso)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
-    for key in keys:
-        suffix = key.removeprefix(prefix)
-        if suffix.isdigit():
-            max_index = max(max_index, int(suffix))
 
-    return max_index + 1
+# Prefixo das chaves por tipo de entrada numerada
+_KEY_PREFIXES = {
+    "preference": "preference_",
+    "reminder": "reminder_",
+}
 
 
 def _memory_type_from_key(key):
-    if key.startswith("preference_"):
-        return "preference"
-    if key.startswith("reminder_"):
-        return "reminder"
+    for entry_type, prefix in _KEY_PREFIXES.items():
+        if key.startswith(prefix):
+            return entry_type
     return "fact"
 
 
 def _memory_index_from_key(key):
-    for prefix in ("preference_", "reminder_"):
+    for prefix in _KEY_PREFIXES.values():
         if key.startswith(prefix):
             suffix = key.removeprefix(prefix)
             if suffix.isdigit():
@@ -53,13 +115,10 @@ def _memory_index_from_key(key):
     return None
 
 
-def _memory_label_from_key(key):
+def _memory_label(key, entry_type, index):
     if key == "name":
         return "Nome"
 
-    entry_type = _memory_type_from_key(key)
-    index = _memory_index_from_key(key)
-
     if entry_type == "preference":
         return f"Preferencia {index}" if index is not None else "Preferencia"
 
@@ -70,77 +129,196 @@ def _memory_label_from_key(key):
 
 
 def _normalize_entry(row):
-    key = row["key"]
-
     return {
-        "key": key,
+        "key": row["key"],
         "value": row["value"],
-        "type": _memory_type_from_key(key),
-        "label": _memory_label_from_key(key),
-        "index": _memory_index_from_key(key),
+        "type": row["type"],
+        "label": _memory_label(row["key"], row["type"], row["seq"]),
+        "index": row["seq"],
     }
 
 
-def init_db():
+_CREATE_TABLE = """
+    CREATE TABLE user_memory (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        type TEXT NOT NULL DEFAULT 'fact',
+        seq INTEGER,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+"""
+
+
+def _migrate_typed_columns(conn):
     """
-    Cria a base de dados se nao existir.
+    Versao 1: colunas type/seq/created_at/updated_at em vez de codificar
+    tudo na chave. Converte as entradas da tabela antiga (key, value).
     """
-    conn = _connect()
-    c = conn.cursor()
-    c.execute(
+    legacy = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'user_memory'"
+    ).fetchone()
+    rows = []
+
+    if legacy:
+        rows = conn.execute("SELECT key, value FROM user_memory ORDER BY rowid").fetchall()
+        conn.execute("DROP TABLE user_memory")
+
+    conn.execute(_CREATE_TABLE)
+    conn.execute("CREATE UNIQUE INDEX idx_user_memory_type_seq ON user_memory (type, seq)")
+
+    now = time.time()
+    next_seq = {}
+    converted = []
+
+    for row in rows:
+        entry_type = _memory_type_from_key(row["key"])
+        seq = None
+        if entry_type != "fact":
+            seq = _memory_index_from_key(row["key"])
+            if seq is None or seq in next_seq.get(entry_type, ()):
+                # chave fora do formato prefixo_N: numera a seguir as outras
+                seq = None
+        converted.append((row["key"], row["value"] or "", entry_type, seq))
+        if seq is not None:
+            next_seq.setdefault(entry_type, set()).add(seq)
+
+    for index, (key, value, entry_type, seq) in enumerate(converted):
+        if entry_type != "fact" and seq is None:
+            used = next_seq.setdefault(entry_type, set())
+            seq = max(used, default=0) + 1
+            used.add(seq)
+            converted[index] = (key, value, entry_type, seq)
+
+    conn.executemany(
+        "INSERT INTO user_memory (key, value, type, seq, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [(key, value, entry_type, seq, now, now) for key, value, entry_type, seq in converted],
+    )
+
+
+def _migrate_fts(conn):
+    """
+    Versao 2: indice FTS5 dos valores, sincronizado por triggers.
+
+    O indice guarda a sua propria copia (key/type/value) em vez de apontar
+    para o rowid de user_memory, que um VACUUM pode renumerar. Se o SQLite
+    nao tiver FTS5 nao e criado nada e search_memory usa outra estrategia.
+    """
+    try:
+        conn.execute(
+            """
+            CREATE VIRTUAL TABLE user_memory_fts USING fts5(
+                value,
+                key UNINDEXED,
+                type UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
         """
-        CREATE TABLE IF NOT EXISTS user_memory (
-            key TEXT PRIMARY KEY,
-            value TEXT
         )
+    except sqlite3.OperationalError:
+        return
+
+    conn.execute(
+        """
+        CREATE TRIGGER user_memory_fts_insert AFTER INSERT ON user_memory BEGIN
+            INSERT INTO user_memory_fts (value, key, type) VALUES (new.value, new.key, new.type);
+        END
+    """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER user_memory_fts_delete AFTER DELETE ON user_memory BEGIN
+            DELETE FROM user_memory_fts WHERE key = old.key;
+        END
     """
     )
+    conn.execute(
+        """
+        CREATE TRIGGER user_memory_fts_update AFTER UPDATE OF key, value, type ON user_memory BEGIN
+            DELETE FROM user_memory_fts WHERE key = old.key;
+            INSERT INTO user_memory_fts (value, key, type) VALUES (new.value, new.key, new.type);
+        END
+    """
+    )
+    conn.execute("INSERT INTO user_memory_fts (value, key, type) SELECT value, key, type FROM user_memory")
+
+
+# Migracoes por ordem; PRAGMA user_version guarda quantas ja foram aplicadas
+_MIGRATIONS = [
+    _migrate_typed_columns,
+    _migrate_fts,
+]
+
+
+def init_db():
+    """
+    Cria a base de dados se nao existir e aplica as migracoes em falta.
+    """
+    conn = _connect()
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(_MIGRATIONS):
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migration in _MIGRATIONS[version:]:
+            migration(conn)
+        conn.execute(f"PRAGMA user_version = {len(_MIGRATIONS)}")
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
-    conn.close()
+    _bump_version()
 
 
 def save_fact(key, value):
     """
     Guarda ou atualiza um facto do utilizador.
     """
+    now = time.time()
     conn = _connect()
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR REPLACE INTO user_memory (key, value) VALUES (?, ?)",
-        (key, value),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO user_memory (key, value, type, seq, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value,
+                updated_at = excluded.updated_at
+        """,
+            (key, value, _memory_type_from_key(key), _memory_index_from_key(key), now, now),
+        )
+    _bump_version()
+
+
+def _save_numbered(entry_type, value):
+    """Insere com o seq seguinte do tipo, calculado na propria query (atomico)."""
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO user_memory (key, value, type, seq, created_at, updated_at)
+            SELECT ? || next_seq, ?, ?, next_seq, ?, ?
+            FROM (SELECT COALESCE(MAX(seq), 0) + 1 AS next_seq FROM user_memory WHERE type = ?)
+        """,
+            (_KEY_PREFIXES[entry_type], value, entry_type, now, now, entry_type),
+        )
+    _bump_version()
 
 
 def save_preference(preference_text):
     """
     Guarda uma preferencia do utilizador.
     """
-    conn = _connect()
-    c = conn.cursor()
-    key = f"preference_{_next_index('preference_')}"
-    c.execute(
-        "INSERT INTO user_memory (key, value) VALUES (?, ?)",
-        (key, preference_text),
-    )
-    conn.commit()
-    conn.close()
+    _save_numbered("preference", preference_text)
 
 
 def save_reminder(reminder_text):
     """
     Guarda um lembrete do utilizador.
     """
-    conn = _connect()
-    c = conn.cursor()
-    key = f"reminder_{_next_index('reminder_')}"
-    c.execute(
-        "INSERT INTO user_memory (key, value) VALUES (?, ?)",
-        (key, reminder_text),
-    )
-    conn.commit()
-    conn.close()
+    _save_numbered("reminder", reminder_text)
 
 
 def delete_fact(key):
@@ -148,40 +326,43 @@ def delete_fact(key):
     Remove um facto da memoria.
     """
     conn = _connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM user_memory WHERE key = ?", (key,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("DELETE FROM user_memory WHERE key = ?", (key,))
+    _bump_version()
+
+
+def _delete_numbered(entry_type, index):
+    """Remove a entrada na posicao index (1-based) do tipo, por ordem de seq."""
+    if index < 1:
+        return
+
+    conn = _connect()
+    with conn:
+        deleted = conn.execute(
+            """
+            DELETE FROM user_memory WHERE key = (
+                SELECT key FROM user_memory WHERE type = ? ORDER BY seq LIMIT 1 OFFSET ?
+            )
+        """,
+            (entry_type, index - 1),
+        ).rowcount
+
+    if deleted:
+        _bump_version()
 
 
 def delete_preference(index):
     """
     Remove uma preferencia pelo indice (1-based).
     """
-    conn = _connect()
-    c = conn.cursor()
-    c.execute("SELECT key FROM user_memory WHERE key LIKE 'preference_%' ORDER BY key")
-    keys = [row["key"] for row in c.fetchall()]
-    if 1 <= index <= len(keys):
-        key_to_delete = keys[index - 1]
-        c.execute("DELETE FROM user_memory WHERE key = ?", (key_to_delete,))
-        conn.commit()
-    conn.close()
+    _delete_numbered("preference", index)
 
 
 def delete_reminder(index):
     """
     Remove um lembrete pelo indice (1-based).
     """
-    conn = _connect()
-    c = conn.cursor()
-    c.execute("SELECT key FROM user_memory WHERE key LIKE 'reminder_%' ORDER BY key")
-    keys = [row["key"] for row in c.fetchall()]
-    if 1 <= index <= len(keys):
-        key_to_delete = keys[index - 1]
-        c.execute("DELETE FROM user_memory WHERE key = ?", (key_to_delete,))
-        conn.commit()
-    conn.close()
+    _delete_numbered("reminder", index)
 
 
 def load_facts():
@@ -189,23 +370,19 @@ def load_facts():
     Devolve todos os factos conhecidos como dicionario.
     Inclui preferencias e lembretes como listas.
     """
-    conn = _connect()
-    c = conn.cursor()
-    c.execute("SELECT key, value FROM user_memory")
-    rows = c.fetchall()
-    conn.close()
+    rows = _connect().execute("SELECT key, value, type FROM user_memory ORDER BY type, seq").fetchall()
 
     facts = {}
     preferences = []
     reminders = []
 
-    for key, value in [(row["key"], row["value"]) for row in rows]:
-        if key.startswith("preference_"):
-            preferences.append(value)
-        elif key.startswith("reminder_"):
-            reminders.append(value)
+    for row in rows:
+        if row["type"] == "preference":
+            preferences.append(row["value"])
+        elif row["type"] == "reminder":
+            reminders.append(row["value"])
         else:
-            facts[key] = value
+            facts[row["key"]] = row["value"]
 
     facts["preferences"] = preferences
     facts["reminders"] = reminders
@@ -216,31 +393,94 @@ def load_facts():
 def list_memory_entries():
     """
     Devolve a memoria numa estrutura adequada para APIs e UI.
+
+    Ordem: factos, preferencias e lembretes (a ordem alfabetica dos tipos),
+    cada grupo por seq; toda a ordenacao vem do indice (type, seq).
     """
-    conn = _connect()
-    c = conn.cursor()
-    c.execute("SELECT key, value FROM user_memory")
-    rows = c.fetchall()
-    conn.close()
+    rows = _connect().execute("SELECT key, value, type, seq FROM user_memory ORDER BY type, seq").fetchall()
 
-    entries = [_normalize_entry(row) for row in rows]
+    return [_normalize_entry(row) for row in rows]
 
-    type_order = {
-        "fact": 0,
-        "preference": 1,
-        "reminder": 2,
-    }
 
-    entries.sort(
-        key=lambda entry: (
-            type_order.get(entry["type"], 99),
-            entry["index"] if entry["index"] is not None else 0,
-            entry["label"].lower(),
-            entry["key"].lower(),
-        )
+_WORD_RE = re.compile(r"\w+")
+
+# Palavras sem valor para a pesquisa (inclui as que todas as preferencias
+# guardadas por memory/extract.py tem: "sempre que ..., quero que ...")
+SEARCH_STOPWORDS = frozenset(
+    """
+    que para com uma uns umas por pelo pela pelos pelas como mais mas nao sim
+    isso isto este esta esse essa aquele aquela qual quais quando onde quem
+    tem ter sou sao estou esta estas meu minha meus minhas teu tua seu sua
+    dos das nos nas ele ela eles elas voce diz diga dizer quero queres podes
+    pode sempre jarvis ola obrigado
+    """.split()
+)
+
+
+def _strip_accents(text):
+    normalized = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in normalized if unicodedata.category(ch) != "Mn")
+
+
+def search_words(text):
+    """Palavras uteis para pesquisa: minusculas, sem acentos, sem stopwords."""
+    return [
+        word
+        for word in _WORD_RE.findall(_strip_accents((text or "").lower()))
+        if len(word) >= 3 and word not in SEARCH_STOPWORDS
+    ]
+
+
+def _search_terms(text):
+    """
+    Converte uma mensagem numa query FTS5 (termos unidos por OR).
+
+    Palavras com 5 ou mais letras perdem a ultima e passam a prefixo, para
+    apanhar plurais e flexoes simples (jogos -> "jogo"*).
+    """
+    return " OR ".join(
+        f'"{word[:-1]}"*' if len(word) >= 5 else f'"{word}"'
+        for word in dict.fromkeys(search_words(text))
     )
 
-    return entries
+
+def _has_fts(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_memory_fts'"
+    ).fetchone() is not None
+
+
+def search_memory(text, limit):
+    """
+    Preferencias e lembretes mais relevantes para text, os melhores primeiro.
+
+    Ordena por BM25 no indice FTS5. Sem FTS5 devolve as entradas alteradas
+    mais recentemente. Cada resultado tem key, type e value.
+    """
+    conn = _connect()
+
+    if not _has_fts(conn):
+        rows = conn.execute(
+            "SELECT key, type, value FROM user_memory WHERE type != 'fact' ORDER BY updated_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    query = _search_terms(text or "")
+    if not query:
+        return []
+
+    rows = conn.execute(
+        """
+        SELECT key, type, value FROM user_memory_fts
+        WHERE user_memory_fts MATCH ? AND type != 'fact'
+        ORDER BY rank
+        LIMIT ?
+    """,
+        (query, limit),
+    ).fetchall()
+
+    return [dict(row) for row in rows]
 
 
 def update_memory_entry(key, value):
@@ -253,25 +493,19 @@ def update_memory_entry(key, value):
         raise ValueError("O valor da memoria nao pode estar vazio.")
 
     conn = _connect()
-    c = conn.cursor()
-    c.execute("SELECT key FROM user_memory WHERE key = ?", (key,))
-    row = c.fetchone()
+    with conn:
+        conn.execute(
+            "UPDATE user_memory SET value = ?, updated_at = ? WHERE key = ?",
+            (clean_value, time.time(), key),
+        )
+        row = conn.execute("SELECT key, value, type, seq FROM user_memory WHERE key = ?", (key,)).fetchone()
 
     if row is None:
-        conn.close()
         raise KeyError(key)
 
-    c.execute("UPDATE user_memory SET value = ? WHERE key = ?", (clean_value, key))
-    conn.commit()
-    conn.close()
+    _bump_version()
 
-    return {
-        "key": key,
-        "value": clean_value,
-        "type": _memory_type_from_key(key),
-        "label": _memory_label_from_key(key),
-        "index": _memory_index_from_key(key),
-    }
+    return _normalize_entry(row)
 
 
 def delete_memory_entry(key):
@@ -279,11 +513,9 @@ def delete_memory_entry(key):
     Remove uma entrada de memoria pelo identificador real.
     """
     conn = _connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM user_memory WHERE key = ?", (key,))
-    deleted = c.rowcount > 0
-    conn.commit()
-    conn.close()
+    with conn:
+        deleted = conn.execute("DELETE FROM user_memory WHERE key = ?", (key,)).rowcount > 0
+    _bump_version()
     return deleted
 
 
@@ -292,9 +524,7 @@ def clear_memory():
     Remove todas as entradas de memoria.
     """
     conn = _connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM user_memory")
-    deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
+    with conn:
+        deleted_count = conn.execute("DELETE FROM user_memory").rowcount
+    _bump_version()
     return deleted_count
@@ -0,0 +1,357 @@
+"""
+Pesquisa semantica na memoria do utilizador.
+
+Cada preferencia e lembrete tem um embedding calculado pelo Ollama
+(EMBED_MODEL), que aproxima parafrases: "o tempo" encontra uma preferencia
+sobre a "previsao meteorologica". Para testes e maquinas sem o modelo ha
+um embedding deterministico, feito com hashing de palavras e trigramas,
+que so aproxima textos com palavras ou raizes em comum.
+
+Os vetores (normalizados) ficam numa matriz float32 contigua, guardada ao
+lado da base de dados (memory.vectors.npz). A pesquisa e um produto
+matriz-vetor (similaridade de cosseno) seguido de argpartition para o top-k.
+
+O indice e atualizado de forma incremental na pesquisa seguinte a uma
+escrita (de qualquer processo), detetada pela memory_version: so as
+entradas novas ou alteradas sao recalculadas e as removidas saem da
+matriz. Escrever na memoria nunca espera por embeddings.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Callable
+
+import numpy as np
+
+from config import EMBED_MODEL, MEMORY_EMBEDDINGS, MEMORY_MIN_SIMILARITY, MEMORY_TOP_K
+from llm.ollama import LLMUnavailableError, aembed_texts, embed_texts
+from memory import user_memory
+from net.breaker import CircuitOpenError, get_breaker
+
+# Dimensao do embedding deterministico
+HASH_EMBED_DIM = 256
+
+# Peso dos trigramas face as palavras inteiras no embedding deterministico
+HASH_NGRAM_WEIGHT = 0.5
+
+# O embedding deterministico da similaridades mais baixas que um modelo
+# real; este e o minimo equivalente a MEMORY_MIN_SIMILARITY
+HASH_MIN_SIMILARITY = 0.2
+
+_breaker = get_breaker("ollama_embeddings")
+_index = None
+_index_lock = threading.Lock()
+
+
+def hash_embed(texts, dim: int = HASH_EMBED_DIM) -> np.ndarray:
+    """
+    Embedding deterministico, sem modelo: cada palavra e cada trigrama
+    (com acentos removidos) soma +-1 numa posicao escolhida por hash.
+    Textos com palavras ou raizes em comum ficam proximos.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+
+    for row, text in enumerate(texts):
+        for word in user_memory.search_words(text):
+            features = [(word, 1.0)]
+            padded = f"#{word}#"
+            features += [(padded[i:i + 3], HASH_NGRAM_WEIGHT) for i in range(len(padded) - 2)]
+
+            for feature, weight in features:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % dim] += sign * weight
+
+    return vectors
+
+
+def _as_matrix(embeddings, texts) -> np.ndarray:
+    """Valida a resposta do Ollama: uma linha numerica, nao vazia, por texto."""
+    try:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+    except (TypeError, ValueError) as exc:
+        raise LLMUnavailableError("O Ollama devolveu embeddings invalidos.") from exc
+
+    if vectors.ndim != 2 or len(vectors) != len(texts) or not vectors.shape[1]:
+        raise LLMUnavailableError(
+            f"O Ollama devolveu embeddings com formato {vectors.shape} para {len(texts)} textos."
+        )
+
+    return vectors
+
+
+def ollama_embed(texts) -> np.ndarray:
+    """Embeddings do Ollama; uma resposta com formato inesperado conta como falha."""
+    with _breaker.guard():
+        return _as_matrix(embed_texts(texts), texts)
+
+
+async def aollama_embed(texts) -> np.ndarray:
+    """Versao assincrona de ollama_embed."""
+    with _breaker.guard():
+        return _as_matrix(await aembed_texts(texts), texts)
+
+
+class VectorIndex:
+    """
+    Matriz de embeddings das preferencias e lembretes, sincronizada com a memoria.
+
+    aembed e a versao assincrona de embed, usada por asearch; sem ela embed
+    corre no proprio event loop, o que so serve para embeddings locais
+    (hash_embed).
+    """
+
+    def __init__(
+        self,
+        embed: Callable,
+        model_id: str,
+        path: str | None = None,
+        min_score: float = MEMORY_MIN_SIMILARITY,
+        aembed: Callable | None = None,
+    ):
+        self.embed = embed
+        self.aembed = aembed
+        self.model_id = model_id
+        self.min_score = min_score
+        self._path = path
+        self._keys: list[str] = []
+        self._types: list[str] = []
+        self._values: list[str] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._version = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        """Ficheiro da matriz, ao lado de DB_FILE (que pode mudar, ex: benchmark)."""
+        return self._path or os.path.splitext(user_memory.DB_FILE)[0] + ".vectors.npz"
+
+    def __len__(self):
+        return len(self._keys)
+
+    def refresh(self) -> None:
+        """
+        Sincroniza com a base de dados, calculando so os embeddings em falta.
+
+        Os embeddings sao pedidos fora do _lock, por isso outras pesquisas
+        continuam a usar a matriz atual entretanto. Se outra thread mudar o
+        indice nesse intervalo, a diferenca e calculada de novo.
+        """
+        while True:
+            changes = self._diff()
+            if changes is None:
+                return
+
+            added = changes[3]
+            vectors = self._normalize(self.embed([entry["value"] for entry in added])) if added else None
+
+            if self._apply(changes, vectors):
+                return
+
+    async def arefresh(self) -> None:
+        """
+        Versao assincrona de refresh.
+
+        Os embeddings usam aembed; so a leitura do SQLite e a escrita da
+        matriz em disco passam por uma thread.
+        """
+        while True:
+            changes = await asyncio.to_thread(self._diff)
+            if changes is None:
+                return
+
+            added = changes[3]
+            vectors = self._normalize(await self._aembed([entry["value"] for entry in added])) if added else None
+
+            if await asyncio.to_thread(self._apply, changes, vectors):
+                return
+
+    def _diff(self):
+        """
+        Compara o indice com a base de dados.
+
+        Devolve None se estiver em dia ou (versao, chaves atuais, linhas a
+        manter, entradas a calcular).
+        """
+        with self._lock:
+            version = user_memory.memory_version()
+            if version == self._version:
+                return None
+
+            if not self._loaded:
+                self._load()
+
+            keys = self._keys
+            entries = [entry for entry in user_memory.list_memory_entries() if entry["type"] != "fact"]
+            known = {key: (row, value) for row, (key, value) in enumerate(zip(keys, self._values))}
+
+            kept = []
+            added = []
+            for entry in entries:
+                row, value = known.get(entry["key"], (None, None))
+                if row is not None and value == entry["value"]:
+                    kept.append(row)
+                else:
+                    added.append(entry)
+
+            return version, keys, kept, added
+
+    def _apply(self, changes, vectors) -> bool:
+        """Aplica o resultado de _diff; False se o indice mudou entretanto."""
+        version, keys, kept, added = changes
+
+        with self._lock:
+            if self._keys is not keys:
+                return False
+
+            if added or len(kept) != len(keys):
+                matrix = self._matrix[kept]
+                if added:
+                    matrix = vectors if not kept else np.vstack([matrix, vectors])
+
+                self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+                self._keys = [keys[row] for row in kept] + [entry["key"] for entry in added]
+                self._types = [self._types[row] for row in kept] + [entry["type"] for entry in added]
+                self._values = [self._values[row] for row in kept] + [entry["value"] for entry in added]
+                self._save()
+
+            self._version = version
+            return True
+
+    async def _aembed(self, texts) -> np.ndarray:
+        if self.aembed is None:
+            return self.embed(texts)
+        return await self.aembed(texts)
+
+    def search(self, text: str, limit: int = MEMORY_TOP_K, min_score: float | None = None) -> list:
+        """As limit entradas mais parecidas com text (cosseno >= min_score), melhores primeiro."""
+        self.refresh()
+
+        if not len(self) or limit <= 0:
+            return []
+
+        return self._rank(self.embed([text]), limit, min_score)
+
+    async def asearch(self, text: str, limit: int = MEMORY_TOP_K, min_score: float | None = None) -> list:
+        """Versao assincrona de search."""
+        await self.arefresh()
+
+        if not len(self) or limit <= 0:
+            return []
+
+        return self._rank(await self._aembed([text]), limit, min_score)
+
+    def _rank(self, query, limit: int, min_score: float | None) -> list:
+        min_score = self.min_score if min_score is None else min_score
+
+        with self._lock:
+            keys, types, values, matrix = self._keys, self._types, self._values, self._matrix
+
+        if not keys:
+            return []
+
+        scores = matrix @ self._normalize(query)[0]
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {"key": keys[row], "type": types[row], "value": values[row], "score": float(scores[row])}
+            for row in top
+            if scores[row] >= min_score
+        ]
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _load(self) -> None:
+        self._loaded = True
+        try:
+            with np.load(self.path) as data:
+                if str(data["model"]) != self.model_id:
+                    return
+                self._keys = data["keys"].tolist()
+                self._types = data["types"].tolist()
+                self._values = data["values"].tolist()
+                self._matrix = np.ascontiguousarray(data["matrix"], dtype=np.float32)
+        except (OSError, KeyError, ValueError):
+            # Sem ficheiro (ou de outra versao): o indice e recalculado
+            return
+
+    def _save(self) -> None:
+        path = self.path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                model=np.array(self.model_id),
+                keys=np.array(self._keys, dtype=str),
+                types=np.array(self._types, dtype=str),
+                values=np.array(self._values, dtype=str),
+                matrix=self._matrix,
+            )
+        os.replace(tmp_path, path)
+
+
+def get_index() -> VectorIndex | None:
+    """Indice partilhado conforme MEMORY_EMBEDDINGS (None se desativado)."""
+    global _index
+
+    if MEMORY_EMBEDDINGS is None:
+        return None
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if MEMORY_EMBEDDINGS == "hash":
+                    _index = VectorIndex(hash_embed, f"hash:{HASH_EMBED_DIM}", min_score=HASH_MIN_SIMILARITY)
+                else:
+                    _index = VectorIndex(ollama_embed, f"ollama:{EMBED_MODEL}", aembed=aollama_embed)
+
+    return _index
+
+
+def relevant_memories(text: str, limit: int = MEMORY_TOP_K, semantic: bool = True) -> list:
+    """
+    Preferencias e lembretes mais relevantes para text, os melhores primeiro.
+
+    Usa o indice semantico; se estiver desativado ou os embeddings falharem
+    (ex: modelo em falta no Ollama), usa a pesquisa por palavras (FTS5).
+    Com semantic=False usa logo a pesquisa por palavras, sem esperar por
+    embeddings (ex: respostas rapidas que nao passam pelo Ollama).
+    """
+    index = get_index() if semantic else None
+
+    if index is not None:
+        try:
+            return index.search(text, limit)
+        except (LLMUnavailableError, CircuitOpenError):
+            pass
+
+    return user_memory.search_memory(text, limit)
+
+
+async def arelevant_memories(text: str, limit: int = MEMORY_TOP_K, semantic: bool = True) -> list:
+    """
+    Versao assincrona de relevant_memories.
+
+    Os embeddings sao pedidos com o cliente HTTP assincrono; so o acesso
+    ao SQLite passa por uma thread, para nao bloquear o event loop.
+    """
+    index = get_index() if semantic else None
+
+    if index is not None:
+        try:
+            return await index.asearch(text, limit)
+        except (LLMUnavailableError, CircuitOpenError):
+            pass
+
+    return await asyncio.to_thread(user_memory.search_memory, text, limit)
@@ -0,0 +1 @@
+"""Clientes HTTP partilhados para os servicos externos (Ollama, Open-Meteo, pesquisa)."""
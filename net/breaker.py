@@ -0,0 +1,175 @@
+"""
+Circuit breakers para os servicos externos.
+
+Cada dependencia (cada instancia Ollama, Open-Meteo, pesquisa web) tem um
+breaker com tres estados:
+
+- closed: os pedidos passam; falhas seguidas contam ate failure_threshold
+- open: os pedidos falham de imediato com CircuitOpenError, sem esperar
+  pelos timeouts de rede, durante reset_timeout segundos
+- half_open: passa um pedido de teste; se correr bem o breaker fecha,
+  se falhar volta a abrir
+
+O estado de todos os breakers fica disponivel em breaker_states (/health).
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_breakers: dict[str, CircuitBreaker] = {}
+_registry_lock = Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    """O servico esta marcado como indisponivel; o pedido nem foi tentado."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Servico {name} indisponivel; nova tentativa dentro de {retry_after}s.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+        self._lock = Lock()
+
+    def available(self) -> bool:
+        """Indica se allow() deixaria passar um pedido agora (sem o registar)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return not self._probing
+
+    def allow(self) -> None:
+        """Regista o inicio de um pedido ou levanta CircuitOpenError."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+
+            if self.state == CLOSED:
+                return
+
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self._retry_after_locked())
+
+    def open_error(self) -> CircuitOpenError:
+        """Conta uma rejeicao e devolve o erro a levantar por quem a decidiu."""
+        with self._lock:
+            self.rejected += 1
+            return CircuitOpenError(self.name, self._retry_after_locked())
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after_locked() if self.state == OPEN else 0
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        """Pedido abandonado sem resultado: liberta o pedido de teste, se era o caso."""
+        with self._lock:
+            self._probing = False
+
+    def probe_ok(self) -> None:
+        """Um health check passou: deixa passar ja o proximo pedido de teste."""
+        with self._lock:
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+                self._probing = False
+
+    def trip(self) -> None:
+        """Um health check falhou: abre o breaker sem esperar por pedidos."""
+        with self._lock:
+            if self.state != OPEN:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        """Protege um pedido: allow antes, record_* depois."""
+        self.allow()
+
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.record_cancelled()
+            raise
+        else:
+            self.record_success()
+
+    def _retry_after_locked(self) -> int:
+        if self.state != OPEN:
+            return 1
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(1, math.ceil(remaining))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "retry_after": self._retry_after_locked() if self.state == OPEN else 0,
+            }
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Devolve o breaker partilhado da dependencia, criando-o no primeiro uso."""
+    breaker = _breakers.get(name)
+    if breaker is not None:
+        return breaker
+
+    with _registry_lock:
+        return _breakers.setdefault(name, CircuitBreaker(name))
+
+
+def breaker_states() -> dict:
+    with _registry_lock:
+        breakers = list(_breakers.values())
+
+    return {breaker.name: breaker.stats() for breaker in breakers}
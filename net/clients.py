@@ -0,0 +1,194 @@
+"""
+Clientes HTTP de saida partilhados.
+
+Cada servico externo ("ollama", "open_meteo", "search") tem o seu pool de
+ligacoes keep-alive e os seus timeouts, definidos em config.HTTP_BACKENDS.
+Assim nenhum pedido paga o estabelecimento de uma ligacao TCP nova.
+
+- request: pedido sincrono (requests.Session com pool por host)
+- get_async_client / arequest / astream: pedidos assincronos (httpx)
+- track: contabiliza pedidos feitos com outros clientes (ex: DDGS)
+- pool_stats: estatisticas por servico, expostas em /metrics
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_BACKENDS
+
+_sessions: dict[str, requests.Session] = {}
+_async_clients: dict[str, httpx.AsyncClient] = {}
+_stats: dict[str, dict] = {}
+_lock = Lock()
+
+
+def backend_config(backend: str) -> dict:
+    try:
+        return HTTP_BACKENDS[backend]
+    except KeyError:
+        raise KeyError(f"Servico HTTP desconhecido: {backend}") from None
+
+
+def timeout_for(backend: str) -> tuple[float, float]:
+    """Devolve (connect, read) no formato aceite pelo requests."""
+    config = backend_config(backend)
+    return config["connect_timeout"], config["read_timeout"]
+
+
+def _stats_for(backend: str) -> dict:
+    stats = _stats.get(backend)
+    if stats is None:
+        with _lock:
+            stats = _stats.setdefault(
+                backend,
+                {"requests": 0, "errors": 0, "in_flight": 0, "total_seconds": 0.0},
+            )
+    return stats
+
+
+@contextmanager
+def track(backend: str):
+    """Contabiliza um pedido (latencia, erros, pedidos em curso)."""
+    stats = _stats_for(backend)
+    started = time.perf_counter()
+
+    with _lock:
+        stats["in_flight"] += 1
+
+    try:
+        yield
+    except Exception:
+        with _lock:
+            stats["errors"] += 1
+        raise
+    finally:
+        with _lock:
+            stats["in_flight"] -= 1
+            stats["requests"] += 1
+            stats["total_seconds"] += time.perf_counter() - started
+
+
+def get_session(backend: str) -> requests.Session:
+    session = _sessions.get(backend)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(backend)
+        if session is None:
+            pool_size = backend_config(backend)["pool_size"]
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[backend] = session
+
+    return session
+
+
+def request(backend: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Pedido sincrono com o pool e os timeouts do servico.
+
+    Levanta requests.RequestException em erros de rede ou estados HTTP >= 400.
+    """
+    kwargs.setdefault("timeout", timeout_for(backend))
+
+    with track(backend):
+        response = get_session(backend).request(method, url, **kwargs)
+        response.raise_for_status()
+
+    return response
+
+
+def get_async_client(backend: str) -> httpx.AsyncClient:
+    """
+    Devolve o cliente HTTP assincrono partilhado do servico.
+
+    Pedidos em espera custam uma coroutine e nao uma thread.
+    """
+    client = _async_clients.get(backend)
+
+    if client is None:
+        config = backend_config(backend)
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"]),
+            limits=httpx.Limits(
+                max_connections=config["pool_size"],
+                max_keepalive_connections=config["pool_size"],
+            ),
+        )
+        _async_clients[backend] = client
+
+    return client
+
+
+async def arequest(backend: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """Versao assincrona de request; levanta httpx.HTTPError."""
+    with track(backend):
+        response = await get_async_client(backend).request(method, url, **kwargs)
+        response.raise_for_status()
+
+    return response
+
+
+@asynccontextmanager
+async def astream(backend: str, method: str, url: str, **kwargs):
+    """Pedido assincrono com resposta em streaming (async with)."""
+    with track(backend):
+        async with get_async_client(backend).stream(method, url, **kwargs) as response:
+            response.raise_for_status()
+            yield response
+
+
+async def close_async_clients():
+    """Fecha os pools assincronos (ex: no shutdown do servidor)."""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+
+    for client in clients:
+        await client.aclose()
+
+
+def pool_stats() -> dict:
+    """Estatisticas por servico: pedidos, erros, latencia media e ligacoes abertas."""
+    result = {}
+
+    with _lock:
+        snapshot = {backend: dict(stats) for backend, stats in _stats.items()}
+
+    for backend in HTTP_BACKENDS:
+        stats = snapshot.get(backend, {"requests": 0, "errors": 0, "in_flight": 0, "total_seconds": 0.0})
+        total_seconds = stats.pop("total_seconds")
+        stats["avg_ms"] = round(total_seconds / stats["requests"] * 1000, 1) if stats["requests"] else 0.0
+
+        session = _sessions.get(backend)
+        if session is not None:
+            stats["sync_connections_opened"] = _connections_opened(session)
+
+        result[backend] = stats
+
+    return result
+
+
+def _connections_opened(session: requests.Session) -> int:
+    """Ligacoes TCP criadas pelos pools do urllib3 (mede a reutilizacao keep-alive)."""
+    opened = 0
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            try:
+                opened += pools[key].num_connections
+            except KeyError:
+                continue
+
+    return opened
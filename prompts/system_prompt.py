@@ -11,7 +11,14 @@ Apenas constrói texto.
 
 import json
 
-from memory.user_memory import load_facts
+from config import (
+    MEMORY_RETRIEVAL,
+    MEMORY_TOKEN_BUDGET,
+    OLLAMA_NATIVE_TOOLS,
+    PROMPT_CACHE_FRIENDLY,
+)
+from llm.tokens import estimate_tokens
+from memory.user_memory import load_facts, memory_version
 from tools.registry import TOOLS
 
 # Prompt base que define personalidade e regras do assistente
@@ -25,14 +32,7 @@ SYSTEM_PROMPT = (
     "Usa open_app apenas para aplicações locais instaladas no computador.\n"
     "Quando precisares de informação atual, internet, previsão do tempo, "
     "ou ações no computador, deves pedir uma tool.\n"
-    "Quando quiseres usar uma tool, responde APENAS em JSON válido, sem texto extra.\n"
-    "Formato exato:\n"
-    '{'
-    '"type":"tool_call",'
-    '"tool_name":"NOME_DA_TOOL",'
-    '"arguments":{...}'
-    '}\n'
-    "Se não precisares de tool, responde normalmente em texto.\n"
+    "{tool_format}"
     "Nunca inventes resultados de tools.\n"
     "Personalidade:\n"
     "- Soas como uma pessoa real numa conversa.\n"
@@ -46,36 +46,123 @@ SYSTEM_PROMPT = (
     "- Se o utilizador disser algo social (ex: obrigado), responde de forma educada.\n"
 )
 
+# Formato dos tool calls em texto; com OLLAMA_NATIVE_TOOLS as tools vao no
+# campo "tools" do pedido e o modelo devolve tool calls estruturados
+TOOL_CALL_FORMAT = (
+    "Quando quiseres usar uma tool, responde APENAS em JSON válido, sem texto extra.\n"
+    "Formato exato:\n"
+    '{'
+    '"type":"tool_call",'
+    '"tool_name":"NOME_DA_TOOL",'
+    '"arguments":{...}'
+    '}\n'
+    "Se precisares de várias tools, responde com uma lista JSON desses objetos: [{...}, {...}]\n"
+    "Se não precisares de tool, responde normalmente em texto.\n"
+)
+
+# Cache partilhado por todas as sessoes: id(tools) -> (tools, versao da memoria, opcoes, prompt)
+_prompt_cache = {}
+
+
 def build_system_prompt(available_tools=None):
     """
-    Constrói o system prompt final.
+    Devolve o system prompt final.
 
     Junta:
     - Prompt base
+    - Tools disponíveis
     - Factos conhecidos sobre o utilizador (memória)
 
-    É chamado antes de cada interação com o LLM.
+    É chamado antes de cada interação com o LLM. O resultado fica em cache
+    até a memória mudar (memory_version), por isso o caso comum não lê a
+    base de dados nem serializa as tools, e todas as sessões partilham a
+    mesma string. As listas de tools devem ser tratadas como imutáveis.
+
+    Com PROMPT_CACHE_FRIENDLY a memória vai para o fim: quando muda, o
+    Ollama continua a reutilizar a cache KV da persona e das tools.
+
+    Com OLLAMA_NATIVE_TOOLS as tools não entram no texto: seguem no campo
+    "tools" do pedido ao Ollama (ver llm/ollama.py).
+
+    Com MEMORY_RETRIEVAL o prompt só leva o nome do utilizador; as
+    preferências e lembretes relevantes seguem com cada mensagem (ver
+    build_memory_context), por isso o prompt fica igual entre turnos.
     """
-    prompt = SYSTEM_PROMPT
-    facts = load_facts()
+    tools = available_tools or TOOLS
+    version = memory_version()
+    options = (PROMPT_CACHE_FRIENDLY, OLLAMA_NATIVE_TOOLS, MEMORY_RETRIEVAL)
+    cached = _prompt_cache.get(id(tools))
+
+    if cached is not None and cached[0] is tools and cached[1:3] == (version, options):
+        return cached[3]
+
+    prompt = _render_system_prompt(tools, *options)
+    _prompt_cache[id(tools)] = (tools, version, options, prompt)
+    return prompt
+
+
+def build_memory_context(memories):
+    """
+    Memórias relevantes para a mensagem, a pôr antes do texto do utilizador.
+
+    Recebe as preferências/lembretes já ordenados por relevância (ver
+    memory.vectors.relevant_memories) e fica com os que caibam em
+    MEMORY_TOKEN_BUDGET. Devolve "" quando nada é relevante.
+    """
+    lines = []
+    used = 0
+
+    for entry in memories:
+        label = "Preferência" if entry["type"] == "preference" else "Lembrete"
+        line = f"- {label}: {entry['value']}"
+        tokens = estimate_tokens(line)
+        if used + tokens > MEMORY_TOKEN_BUDGET:
+            continue
+        lines.append(line)
+        used += tokens
+
+    if not lines:
+        return ""
+
+    return "Memória relevante sobre o utilizador:\n" + "\n".join(lines) + "\n\n"
+
+
+def _render_memory(facts, retrieval=False):
+    text = ""
 
     # Exemplo de memória persistente: nome do utilizador
     if "name" in facts:
-        prompt += f"\nSabes que o utilizador chama-se {facts['name']}.\n"
+        text += f"\nSabes que o utilizador chama-se {facts['name']}.\n"
+
+    if retrieval:
+        return text
 
     # Preferências do utilizador
     if facts.get("preferences"):
-        prompt += "\nPreferências do utilizador:\n"
+        text += "\nPreferências do utilizador:\n"
         for pref in facts["preferences"]:
-            prompt += f"- {pref}\n"
+            text += f"- {pref}\n"
 
     # Lembretes do utilizador
     if facts.get("reminders"):
-        prompt += "\nLembretes importantes:\n"
+        text += "\nLembretes importantes:\n"
         for rem in facts["reminders"]:
-            prompt += f"- {rem}\n"
+            text += f"- {rem}\n"
 
-    prompt += "\nTools disponíveis:\n"
-    prompt += json.dumps(available_tools or TOOLS, ensure_ascii=False, indent=2)
+    return text
 
-    return prompt
+
+def _render_system_prompt(tools, cache_friendly=True, native_tools=False, retrieval=False):
+    memory = _render_memory(load_facts(), retrieval)
+
+    if native_tools:
+        base = SYSTEM_PROMPT.replace("{tool_format}", "")
+        tools_text = ""
+    else:
+        base = SYSTEM_PROMPT.replace("{tool_format}", TOOL_CALL_FORMAT)
+        tools_text = "\nTools disponíveis:\n" + json.dumps(tools, ensure_ascii=False, indent=2)
+
+    if cache_friendly:
+        return base + tools_text + "\n" + memory
+
+    return base + memory + tools_text
@@ -0,0 +1,41 @@
+"""
+Testes do pool de instancias Ollama (llm/pool.py), com funcoes falsas em
+vez de pedidos HTTP.
+"""
+
+import asyncio
+import itertools
+import time
+
+import pytest
+
+from llm.pool import BackendPool
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def hedged_pool():
+    """Duas instancias com hedging; a segunda tem o breaker aberto."""
+    # Os breakers sao globais por nome: cada teste usa um nome novo
+    pool = BackendPool(["http://a", "http://b"], name=f"test-pool-{next(_names)}", hedge_after=0.05)
+    pool.backends[1].breaker.trip()
+    return pool
+
+
+def test_hedging_keeps_primary_when_other_backend_is_down(hedged_pool):
+    def slow(url):
+        time.sleep(0.2)
+        return url
+
+    assert hedged_pool.call(slow) == "http://a"
+    assert hedged_pool.stats()["hedged_requests"] == 0
+
+
+def test_async_hedging_keeps_primary_when_other_backend_is_down(hedged_pool):
+    async def slow(url):
+        await asyncio.sleep(0.2)
+        return url
+
+    assert asyncio.run(hedged_pool.acall(slow)) == "http://a"
+    assert hedged_pool.stats()["hedged_requests"] == 0
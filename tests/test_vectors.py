@@ -0,0 +1,137 @@
+"""
+Testes do indice semantico da memoria com o embedding deterministico
+(MEMORY_EMBEDDINGS = "hash"), sem Ollama.
+
+Correr na raiz do projeto: pytest
+"""
+
+import numpy as np
+import pytest
+
+from memory import user_memory, vectors
+
+
+@pytest.fixture
+def memory_db(tmp_path, monkeypatch):
+    """Base de dados de memoria vazia, so para o teste."""
+    monkeypatch.setattr(user_memory, "DB_FILE", str(tmp_path / "memory.db"))
+    monkeypatch.setattr(vectors, "MEMORY_EMBEDDINGS", "hash")
+    monkeypatch.setattr(vectors, "_index", None)
+    user_memory.init_db()
+    yield tmp_path
+    user_memory.close_connection()
+
+
+@pytest.fixture
+def embedded():
+    """Textos enviados para o embedding, um pedido por lista."""
+    calls = []
+
+    def counting_embed(texts):
+        calls.append(list(texts))
+        return vectors.hash_embed(texts)
+
+    return calls, counting_embed
+
+
+def make_index(embed):
+    return vectors.VectorIndex(embed, f"hash:{vectors.HASH_EMBED_DIM}", min_score=vectors.HASH_MIN_SIMILARITY)
+
+
+def saved_entries(index):
+    """Entradas (chave -> valor) e forma da matriz guardadas no ficheiro do indice."""
+    with np.load(index.path) as data:
+        return dict(zip(data["keys"].tolist(), data["values"].tolist())), data["matrix"].shape
+
+
+def test_refresh_only_embeds_new_or_changed_entries(memory_db, embedded):
+    calls, embed = embedded
+    user_memory.save_fact("name", "Ana")
+    user_memory.save_preference("Sempre que perguntar o tempo, quero o tempo no Porto.")
+    user_memory.save_preference("Gosto de jogos de futebol do Benfica.")
+    user_memory.save_reminder("Comprar pão e leite amanhã.")
+
+    index = make_index(embed)
+    index.refresh()
+    # Os factos (ex: nome) ficam no system prompt, nao no indice
+    entries, shape = saved_entries(index)
+    assert len(index) == 3
+    assert sorted(entries) == ["preference_1", "preference_2", "reminder_1"]
+    assert shape == (3, vectors.HASH_EMBED_DIM)
+    assert len(calls) == 1 and len(calls[0]) == 3
+
+    index.refresh()
+    assert len(calls) == 1
+
+    user_memory.update_memory_entry("preference_2", "Gosto de jogos de ténis.")
+    index.refresh()
+    assert calls[-1] == ["Gosto de jogos de ténis."]
+    assert saved_entries(index)[0]["preference_2"] == "Gosto de jogos de ténis."
+
+    user_memory.delete_preference(1)
+    index.refresh()
+    assert len(calls) == 2
+    entries, shape = saved_entries(index)
+    assert len(index) == 2
+    assert sorted(entries) == ["preference_2", "reminder_1"]
+    assert shape == (2, vectors.HASH_EMBED_DIM)
+
+    user_memory.save_reminder("Ligar ao dentista.")
+    index.refresh()
+    assert calls[-1] == ["Ligar ao dentista."]
+    assert len(index) == 3
+
+    # Um indice novo le a matriz guardada em disco sem recalcular nada
+    reloaded = make_index(embed)
+    reloaded.refresh()
+    assert len(calls) == 3
+    assert len(reloaded) == 3
+    top = reloaded.search("ténis", 1)
+    assert [(entry["key"], entry["value"]) for entry in top] == [("preference_2", "Gosto de jogos de ténis.")]
+
+
+def test_writes_do_not_embed_until_next_search(memory_db, embedded):
+    calls, embed = embedded
+    index = make_index(embed)
+    index.refresh()
+
+    user_memory.save_preference("Gosto de música clássica.")
+    assert calls == []
+
+    assert [entry["key"] for entry in index.search("música clássica", 1)] == ["preference_1"]
+    assert calls[0] == ["Gosto de música clássica."]
+
+
+def test_search_returns_top_k_best_first(memory_db, embedded):
+    _, embed = embedded
+    user_memory.save_preference("Sempre que perguntar o tempo, quero o tempo no Porto.")
+    user_memory.save_preference("Gosto de jogos de futebol do Benfica.")
+    user_memory.save_reminder("Comprar pão e leite amanhã.")
+    user_memory.save_preference("Prefiro respostas curtas sobre o tempo.")
+
+    index = make_index(embed)
+    results = index.search("qual o tempo no Porto?", 2, min_score=-1.0)
+
+    assert [entry["key"] for entry in results] == ["preference_1", "preference_3"]
+    assert results[0]["score"] > results[1]["score"]
+
+    everything = index.search("qual o tempo no Porto?", 10, min_score=-1.0)
+    scores = [entry["score"] for entry in everything]
+    assert len(everything) == 4
+    assert scores == sorted(scores, reverse=True)
+
+    # O limite de similaridade corta o que nao tem nada a ver
+    assert [entry["key"] for entry in index.search("qual o tempo no Porto?", 10)] == ["preference_1", "preference_3"]
+    assert index.search("conta uma piada", 3) == []
+    assert index.search("qual o tempo no Porto?", 0) == []
+
+
+def test_relevant_memories_uses_hash_index(memory_db):
+    user_memory.save_preference("Gosto de jogos de futebol do Benfica.")
+    user_memory.save_reminder("Comprar pão e leite amanhã.")
+
+    results = vectors.relevant_memories("o benfica joga hoje?", 3)
+
+    assert [entry["key"] for entry in results][:1] == ["preference_1"]
+    assert vectors.get_index().model_id == f"hash:{vectors.HASH_EMBED_DIM}"
+    assert (memory_db / "memory.vectors.npz").exists()
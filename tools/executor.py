@@ -1,32 +1,65 @@
+import asyncio
 import json
 import re
-from tools.weather import get_weather
-from tools.web_search import search_web
-from tools.desktop import open_website, open_app, type_text, press_keys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from config import TOOL_MAX_WORKERS
 from tools.schemas import tool_result
-from tools.registry import DESKTOP_TOOL_NAMES
+from tools.registry import TOOL_SPECS, ToolSpec
 
+# Pool limitado partilhado por todas as tools bloqueantes
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
 
-def extract_tool_call(text: str):
-    if not isinstance(text, str):
+# Contadores por tool (ver tool_stats)
+_tool_stats = {}
+_stats_lock = threading.Lock()
+
+
+def parse_json_fragment(fragment: str):
+    try:
+        data = json.loads(fragment)
+    except json.JSONDecodeError:
         return None
+    if isinstance(data, dict) and data.get("type") == "tool_call":
+        return data
+    return None
 
-    text = text.strip()
 
-    def parse_json_fragment(fragment: str):
-        try:
-            data = json.loads(fragment)
-        except json.JSONDecodeError:
-            return None
-        if isinstance(data, dict) and data.get("type") == "tool_call":
-            return data
+def parse_tool_calls(fragment: str):
+    """Le um tool call ou uma lista de tool calls; devolve a lista ou None."""
+    try:
+        data = json.loads(fragment)
+    except json.JSONDecodeError:
         return None
 
+    calls = data if isinstance(data, list) else [data]
+    if calls and all(isinstance(call, dict) and call.get("type") == "tool_call" for call in calls):
+        return calls
+    return None
+
+
+def extract_tool_call(text: str):
+    calls = extract_tool_calls(text)
+    return calls[0] if calls else None
+
+
+def extract_tool_calls(text: str) -> list:
+    """Todos os tool calls de uma resposta (JSON exato, lista ou objetos no meio de texto)."""
+    if not isinstance(text, str):
+        return []
+
+    text = text.strip()
+
     # quick path: exact JSON
-    if text.startswith("{") and text.endswith("}"):
-        result = parse_json_fragment(text)
-        if result:
-            return result
+    if text[:1] in ("{", "[") and text[-1:] in ("}", "]"):
+        calls = parse_tool_calls(text)
+        if calls:
+            return calls
+
+    calls = []
 
     # search any JSON object inside the text
     depth = 0
@@ -61,75 +94,275 @@ def extract_tool_call(text: str):
                 candidate = text[start:i+1]
                 result = parse_json_fragment(candidate)
                 if result:
-                    return result
+                    calls.append(result)
+                start = None
 
-    return None
+    return calls
 
 
-def execute_tool(tool_name: str, arguments: dict, allow_desktop_tools: bool = True):
+_JSON_START_RE = re.compile(r"[\[{]")
+
+
+class StreamingToolCallDetector:
+    """
+    Versao incremental de extract_tool_call para respostas em streaming.
+
+    feed recebe os pedacos do LLM e devolve o texto que ja pode ser mostrado:
+    o texto fora de JSON passa logo, e um objeto ou lista JSON fica retido
+    ate fechar. Se for um tool call (ou lista de tool calls), tool_calls
+    fica preenchido e o resto da geracao pode ser cancelado; caso contrario
+    o JSON e libertado como texto normal.
+    """
+
+    def __init__(self):
+        self.tool_calls = None
+        self._consumed = []
+        self._held = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+
+    @property
+    def text(self) -> str:
+        """Todo o texto consumido (ate ao fim do tool call, se houver)."""
+        return "".join(self._consumed)
+
+    def feed(self, chunk: str) -> str:
+        if self.tool_calls is not None or not chunk:
+            return ""
+
+        visible = []
+        i = 0
+
+        while i < len(chunk):
+            if self._depth == 0:
+                match = _JSON_START_RE.search(chunk, i)
+                if match is None:
+                    visible.append(chunk[i:])
+                    break
+                start = match.start()
+                visible.append(chunk[i:start])
+                self._depth = 1
+                self._held = [chunk[start]]
+                i = start + 1
+                continue
+
+            end = self._scan_object(chunk, i)
+            self._held.append(chunk[i:end])
+            i = end
+
+            if self._depth == 0:
+                candidate = "".join(self._held)
+                self._held = []
+                tool_calls = parse_tool_calls(candidate)
+
+                if tool_calls:
+                    self.tool_calls = tool_calls
+                    self._consumed.append(chunk[:i])
+                    return self._visible(visible)
+
+                visible.append(candidate)
+
+        self._consumed.append(chunk)
+        return self._visible(visible)
+
+    def finish(self) -> str:
+        """Fim da resposta: liberta um objeto JSON que ficou por fechar."""
+        held = "".join(self._held)
+        self._held = []
+        return self._visible([held]) if self.tool_calls is None else ""
+
+    def _scan_object(self, chunk: str, i: int) -> int:
+        """Avanca dentro do JSON; devolve onde parou (fecho ou fim do pedaco)."""
+        for j in range(i, len(chunk)):
+            ch = chunk[j]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    return j + 1
+
+        return len(chunk)
+
+    def _visible(self, pieces: list) -> str:
+        text = "".join(pieces)
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+
+def _prepare(call: dict, allow_desktop_tools: bool):
+    """
+    Valida um tool call antes de o executar.
+
+    Devolve (spec, kwargs do handler) ou, se a tool nao puder correr,
+    (None, resultado de erro).
+    """
+    tool_name = call.get("tool_name")
+    spec = TOOL_SPECS.get(tool_name)
+
+    if spec is None:
+        return None, tool_result(tool_name, False, f"Tool desconhecida: {tool_name}")
+
+    if spec.desktop and not allow_desktop_tools:
+        return None, tool_result(
+            tool_name,
+            False,
+            "Esta tool esta desativada neste modo de execucao."
+        )
+
     try:
-        if tool_name in DESKTOP_TOOL_NAMES and not allow_desktop_tools:
-            return tool_result(
-                tool_name,
-                False,
-                "Esta tool esta desativada neste modo de execucao."
-            )
-
-        if tool_name == "get_weather":
-            city = arguments.get("city", "Lisboa")
-            day_offset = arguments.get("day_offset")
-            if day_offset is None:
-                # suporta parâmetro de texto p.ex. "amanhã" -> 1
-                text = arguments.get("text", "")
-                day_offset = parse_day(text)
-            try:
-                day_offset = int(day_offset)
-            except (TypeError, ValueError):
-                day_offset = 1
-            return tool_result(tool_name, True, get_weather(city, day_offset))
-
-        if tool_name == "search_web":
-            query = arguments.get("query", "")
-            return tool_result(tool_name, True, search_web(query))
-
-        if tool_name == "open_website":
-            url = arguments.get("url", "")
-            return tool_result(tool_name, True, open_website(url))
-
-        if tool_name == "open_app":
-            app_name = arguments.get("app_name", "")
-            return tool_result(tool_name, True, open_app(app_name))
-
-        if tool_name == "type_text":
-            text = arguments.get("text", "")
-            return tool_result(tool_name, True, type_text(text))
-
-        if tool_name == "press_keys":
-            keys = arguments.get("keys", "")
-            return tool_result(tool_name, True, press_keys(keys))
-
-        return tool_result(tool_name, False, f"Tool desconhecida: {tool_name}")
+        return spec, spec.validate(call.get("arguments") or {})
+    except ValueError as e:
+        return None, tool_result(tool_name, False, str(e))
+
+
+def _record(tool_name: str, elapsed: float = 0.0, error: bool = False, timeout: bool = False) -> None:
+    with _stats_lock:
+        stats = _tool_stats.setdefault(
+            tool_name,
+            {"calls": 0, "errors": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0},
+        )
+        if timeout:
+            stats["timeouts"] += 1
+            return
 
+        elapsed_ms = elapsed * 1000
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+
+def tool_stats() -> dict:
+    """Execucoes, erros, timeouts e latencia (ms) de cada tool."""
+    with _stats_lock:
+        return {
+            name: {
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "timeouts": stats["timeouts"],
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 1) if stats["calls"] else 0.0,
+                "max_ms": round(stats["max_ms"], 1),
+            }
+            for name, stats in _tool_stats.items()
+        }
+
+
+def _run(spec: ToolSpec, kwargs: dict):
+    """Corre uma tool numa thread do pool (as async com um event loop proprio)."""
+    started = time.monotonic()
+    try:
+        handler = spec.resolve()
+        data = handler(**kwargs) if spec.blocking else asyncio.run(handler(**kwargs))
     except Exception as e:
-        return tool_result(tool_name, False, str(e))
-    
-def parse_day(text):
+        _record(spec.name, time.monotonic() - started, error=True)
+        return tool_result(spec.name, False, str(e))
 
-    text = (text or "").lower()
+    _record(spec.name, time.monotonic() - started)
+    return tool_result(spec.name, True, data)
 
-    if "depois de amanhã" in text or "depois de amanha" in text:
-        return 2
 
-    if "amanhã" in text or "amanha" in text:
-        return 1
+async def _arun(spec: ToolSpec, kwargs: dict):
+    """Corre uma tool async no event loop atual."""
+    started = time.monotonic()
+    try:
+        data = await spec.resolve()(**kwargs)
+    except Exception as e:
+        _record(spec.name, time.monotonic() - started, error=True)
+        return tool_result(spec.name, False, str(e))
+
+    _record(spec.name, time.monotonic() - started)
+    return tool_result(spec.name, True, data)
 
-    if "hoje" in text:
-        return 0
 
-    if "sábado" in text or "sabado" in text:
-        return 3
+def _timeout_result(tool_name: str):
+    return tool_result(tool_name, False, "A tool demorou demasiado tempo a responder.")
 
-    if "domingo" in text:
-        return 4
 
-    return 0
+def execute_tool(tool_name: str, arguments: dict, allow_desktop_tools: bool = True):
+    return execute_tools([{"tool_name": tool_name, "arguments": arguments}], allow_desktop_tools)[0]
+
+
+async def aexecute_tool(tool_name: str, arguments: dict, allow_desktop_tools: bool = True):
+    """Versao assincrona de execute_tool."""
+    results = await aexecute_tools([{"tool_name": tool_name, "arguments": arguments}], allow_desktop_tools)
+    return results[0]
+
+
+def execute_tools(calls: list, allow_desktop_tools: bool = True) -> list:
+    """
+    Executa varios tool calls em paralelo e devolve os resultados pela mesma ordem.
+
+    Cada tool tem o seu limite de tempo (ToolSpec.timeout); uma tool que o
+    excede da um resultado de erro e e cancelada se ainda estiver na fila
+    do pool. Uma thread ja a correr nao pode ser interrompida e termina em
+    fundo.
+    """
+    started = time.monotonic()
+    pending = []
+
+    for call in calls:
+        spec, prepared = _prepare(call, allow_desktop_tools)
+        pending.append((spec, prepared if spec is None else _tool_pool.submit(_run, spec, prepared)))
+
+    results = []
+
+    for spec, item in pending:
+        if spec is None:
+            results.append(item)
+            continue
+
+        remaining = spec.timeout - (time.monotonic() - started)
+        try:
+            results.append(item.result(timeout=max(remaining, 0)))
+        except FutureTimeoutError:
+            item.cancel()
+            _record(spec.name, timeout=True)
+            results.append(_timeout_result(spec.name))
+
+    return results
+
+
+async def aexecute_tools(calls: list, allow_desktop_tools: bool = True) -> list:
+    """
+    Versao assincrona de execute_tools.
+
+    As tools bloqueantes (requests, DDGS, pyautogui) correm no pool de
+    threads sem bloquear o event loop; as async correm no proprio loop e
+    sao canceladas quando excedem o limite de tempo.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def run(call):
+        spec, prepared = _prepare(call, allow_desktop_tools)
+        if spec is None:
+            return prepared
+
+        if spec.blocking:
+            pending = loop.run_in_executor(_tool_pool, _run, spec, prepared)
+        else:
+            pending = _arun(spec, prepared)
+
+        try:
+            return await asyncio.wait_for(pending, spec.timeout)
+        except asyncio.TimeoutError:
+            _record(spec.name, timeout=True)
+            return _timeout_result(spec.name)
+
+    return list(await asyncio.gather(*(run(call) for call in calls)))
@@ -1,3 +1,7 @@
+import importlib
+from dataclasses import dataclass, field
+from typing import Callable
+
 TOOLS = [
     {
         "name": "get_weather",
@@ -43,11 +47,164 @@ TOOLS = [
     }
 ]
 
-DESKTOP_TOOL_NAMES = {
-    "open_website",
-    "open_app",
-    "type_text",
-    "press_keys",
+# Schemas no formato do campo "tools" do Ollama: id(tools) -> (tools, schemas)
+_ollama_schemas = {}
+
+
+def ollama_tool_schemas(tools=None):
+    """Converte uma lista de tools (formato de TOOLS) para o formato do Ollama."""
+    tools = tools or TOOLS
+    cached = _ollama_schemas.get(id(tools))
+    if cached is not None and cached[0] is tools:
+        return cached[1]
+
+    schemas = [
+        {
+            "type": "function",
+            "function": {
+                "name": tool["name"],
+                "description": tool["description"],
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        name: {"type": kind} for name, kind in tool["parameters"].items()
+                    },
+                    "required": list(tool["parameters"]),
+                },
+            },
+        }
+        for tool in tools
+    ]
+    _ollama_schemas[id(tools)] = (tools, schemas)
+    return schemas
+
+
+# Tempo maximo (segundos) de uma tool sem timeout proprio
+DEFAULT_TOOL_TIMEOUT = 10
+
+
+def _to_string(value):
+    return str(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _to_integer(value):
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    return None
+
+
+# Tipos aceites nos argumentos: tipo -> (tipo Python, conversao de outros valores)
+_ARGUMENT_TYPES = {
+    "string": (str, _to_string),
+    "integer": (int, _to_integer),
+    "any": (object, None),
+}
+
+_REQUIRED = object()
+
+
+def compile_validator(name, arguments, defaults=None):
+    """
+    Prepara a validacao dos argumentos de uma tool.
+
+    arguments mapeia nome -> tipo ("string", "integer" ou "any"); os
+    argumentos sem valor em defaults sao obrigatorios. A funcao devolvida
+    recebe os argumentos do LLM e devolve os kwargs do handler, ignorando
+    argumentos desconhecidos, ou levanta ValueError.
+    """
+    defaults = defaults or {}
+    checks = []
+
+    for arg_name, kind in arguments.items():
+        accepted, convert = _ARGUMENT_TYPES[kind]
+        checks.append((arg_name, kind, accepted, convert, defaults.get(arg_name, _REQUIRED)))
+
+    def validate(values):
+        if not isinstance(values, dict):
+            raise ValueError(f"Argumentos invalidos para {name}.")
+
+        kwargs = {}
+        for arg_name, kind, accepted, convert, default in checks:
+            value = values.get(arg_name)
+
+            if value is None:
+                if default is _REQUIRED:
+                    raise ValueError(f"Falta o argumento '{arg_name}' da tool {name}.")
+                kwargs[arg_name] = default
+                continue
+
+            if not isinstance(value, accepted) or (isinstance(value, bool) and kind == "integer"):
+                value = convert(value) if convert else None
+                if value is None:
+                    raise ValueError(f"O argumento '{arg_name}' da tool {name} deve ser {kind}.")
+
+            kwargs[arg_name] = value
+
+        return kwargs
+
+    return validate
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    """
+    Como executar uma tool.
+
+    handler e "modulo:funcao" e so e importado na primeira execucao, para
+    que o modo servidor nao carregue as tools de desktop (pyautogui).
+    Tools com blocking=False tem um handler async, que corre no event loop
+    em vez de ocupar uma thread do executor. Com direct_answer o resultado
+    ja e uma frase pronta para o utilizador e e devolvido tal como esta,
+    sem uma segunda chamada ao LLM para o reformular.
+    """
+
+    name: str
+    handler: str
+    arguments: dict
+    defaults: dict = field(default_factory=dict)
+    timeout: float = DEFAULT_TOOL_TIMEOUT
+    blocking: bool = True
+    desktop: bool = False
+    direct_answer: bool = False
+    validate: Callable = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "validate", compile_validator(self.name, self.arguments, self.defaults))
+
+    def resolve(self) -> Callable:
+        handler = _handlers.get(self.handler)
+        if handler is None:
+            module_name, function_name = self.handler.split(":")
+            handler = getattr(importlib.import_module(module_name), function_name)
+            _handlers[self.handler] = handler
+        return handler
+
+
+# Handlers ja importados: "modulo:funcao" -> funcao
+_handlers = {}
+
+TOOL_SPECS = {
+    spec.name: spec
+    for spec in (
+        ToolSpec(
+            "get_weather",
+            "tools.weather:weather_tool",
+            {"city": "string", "day_offset": "any", "text": "string"},
+            defaults={"city": "Lisboa", "day_offset": None, "text": ""},
+            timeout=10,
+            direct_answer=True,
+        ),
+        ToolSpec("search_web", "tools.web_search:search_web", {"query": "string"}, timeout=15),
+        ToolSpec("open_website", "tools.desktop:open_website", {"url": "string"}, desktop=True),
+        ToolSpec("open_app", "tools.desktop:open_app", {"app_name": "string"}, desktop=True),
+        ToolSpec("type_text", "tools.desktop:type_text", {"text": "string"}, desktop=True),
+        ToolSpec("press_keys", "tools.desktop:press_keys", {"keys": "string"}, desktop=True),
+    )
 }
 
+DESKTOP_TOOL_NAMES = {spec.name for spec in TOOL_SPECS.values() if spec.desktop}
+
+DIRECT_ANSWER_TOOL_NAMES = {spec.name for spec in TOOL_SPECS.values() if spec.direct_answer}
+
+
 API_SAFE_TOOLS = [tool for tool in TOOLS if tool["name"] not in DESKTOP_TOOL_NAMES]
@@ -1,5 +1,36 @@
 import random
-import requests
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from net import clients
+from net.breaker import get_breaker
+
+_breaker = get_breaker("open_meteo")
+
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Fuso dos dias da previsao ("hoje", "amanha"), pedido tambem ao Open-Meteo
+FORECAST_TIMEZONE = "Europe/Lisbon"
+
+try:
+    _forecast_tz = ZoneInfo(FORECAST_TIMEZONE)
+except ZoneInfoNotFoundError:
+    # Windows sem o pacote tzdata: usa o fuso local da maquina
+    _forecast_tz = None
+
+# O Open-Meteo atualiza as previsoes de hora a hora; a cache expira uns
+# minutos depois de cada hora, quando a nova previsao ja esta disponivel
+FORECAST_UPDATE_DELAY = 5 * 60
+
+# Espera ate nova tentativa quando a pre-busca falha
+PREFETCH_RETRY = 60
+
+# (lat, lon) -> (previsao diaria, instante em que expira)
+_forecasts = {}
+_forecasts_lock = threading.Lock()
+_prefetch_thread = None
 
 CITY_COORDS = {
     "lisboa": (38.72, -9.13),
@@ -11,6 +42,94 @@ CITY_COORDS = {
 }
 
 
+def _next_update(now: float | None = None) -> float:
+    """
+    Instante em que a previsao em cache deixa de servir: a proxima
+    atualizacao horaria ou a meia-noite seguinte, o que vier primeiro.
+    A meia-noite "hoje" passa a ser outro dia da previsao.
+    """
+    now = time.time() if now is None else now
+    hourly = ((now - FORECAST_UPDATE_DELAY) // 3600 + 1) * 3600 + FORECAST_UPDATE_DELAY
+    return min(hourly, _next_midnight(now))
+
+
+def _next_midnight(now: float) -> float:
+    today = datetime.fromtimestamp(now, _forecast_tz).date()
+    midnight = datetime.combine(today + timedelta(days=1), datetime.min.time(), _forecast_tz)
+    return midnight.timestamp()
+
+
+def _fetch_forecasts(coords: list) -> list:
+    """
+    Obtem a previsao diaria de varias localizacoes num unico pedido.
+
+    O Open-Meteo aceita latitudes e longitudes separadas por virgulas e
+    devolve uma lista com uma previsao por localizacao.
+    """
+    url = (
+        f"{FORECAST_URL}"
+        f"?latitude={','.join(str(lat) for lat, _ in coords)}"
+        f"&longitude={','.join(str(lon) for _, lon in coords)}"
+        "&daily=temperature_2m_max,temperature_2m_min"
+        f"&timezone={FORECAST_TIMEZONE}"
+    )
+
+    with _breaker.guard():
+        data = clients.request("open_meteo", "GET", url).json()
+
+    results = data if isinstance(data, list) else [data]
+    forecasts = [result.get("daily", {}) for result in results]
+    expires_at = _next_update()
+
+    with _forecasts_lock:
+        for coord, daily in zip(coords, forecasts):
+            _forecasts[coord] = (daily, expires_at)
+
+    return forecasts
+
+
+def get_forecast(lat: float, lon: float) -> dict:
+    """Previsao diaria (todos os dias) para as coordenadas, com cache."""
+    with _forecasts_lock:
+        cached = _forecasts.get((lat, lon))
+
+    if cached is not None and time.time() < cached[1]:
+        return cached[0]
+
+    return _fetch_forecasts([(lat, lon)])[0]
+
+
+def prefetch_forecasts() -> None:
+    """Atualiza a cache de todas as cidades de CITY_COORDS num so pedido."""
+    _fetch_forecasts(list(dict.fromkeys(CITY_COORDS.values())))
+
+
+def start_forecast_prefetch() -> None:
+    """
+    Arranca (uma vez) a thread que mantem a cache das cidades conhecidas.
+
+    A previsao e pedida logo e de novo a cada atualizacao horaria, por isso
+    as perguntas sobre estas cidades nunca esperam pela rede.
+    """
+    global _prefetch_thread
+
+    if _prefetch_thread is not None:
+        return
+
+    def loop():
+        while True:
+            try:
+                prefetch_forecasts()
+                delay = _next_update() - time.time()
+            except Exception as exc:
+                print("ERRO PREVISAO:", exc)
+                delay = PREFETCH_RETRY
+            time.sleep(max(delay, 1))
+
+    _prefetch_thread = threading.Thread(target=loop, name="weather-prefetch", daemon=True)
+    _prefetch_thread.start()
+
+
 def get_weather(city: str = "Lisboa", day_offset: int = 1) -> str:
     """
     Obtém previsão do tempo.
@@ -25,19 +144,10 @@ def get_weather(city: str = "Lisboa", day_offset: int = 1) -> str:
     city_key = city.lower().strip()
     lat, lon = CITY_COORDS.get(city_key, CITY_COORDS["lisboa"])
 
-    url = (
-        "https://api.open-meteo.com/v1/forecast"
-        f"?latitude={lat}&longitude={lon}"
-        "&daily=temperature_2m_max,temperature_2m_min"
-        "&timezone=Europe/Lisbon"
-    )
-
-    r = requests.get(url, timeout=10)
-    r.raise_for_status()
-    data = r.json()
+    daily = get_forecast(lat, lon)
 
     # Limitar day_offset ao intervalo disponível
-    max_days = len(data.get("daily", {}).get("temperature_2m_max", [])) - 1
+    max_days = len(daily.get("temperature_2m_max", [])) - 1
     if max_days < 0:
         raise ValueError("Dados de temperatura não disponíveis no serviço de previsão")
 
@@ -46,8 +156,8 @@ def get_weather(city: str = "Lisboa", day_offset: int = 1) -> str:
     elif day_offset > max_days:
         day_offset = max_days
 
-    temp_max = data["daily"]["temperature_2m_max"][day_offset]
-    temp_min = data["daily"]["temperature_2m_min"][day_offset]
+    temp_max = daily["temperature_2m_max"][day_offset]
+    temp_min = daily["temperature_2m_min"][day_offset]
 
     day_names = ["hoje", "amanhã", "depois de amanhã"]
     day_label = day_names[day_offset] if day_offset < len(day_names) else f"daqui a {day_offset} dias"
@@ -70,4 +180,37 @@ def get_weather(city: str = "Lisboa", day_offset: int = 1) -> str:
         city=city.title(),
         temp_min=temp_min,
         temp_max=temp_max,
-    )
\ No newline at end of file
+    )
+
+
+def weather_tool(city: str = "Lisboa", day_offset=None, text: str = "") -> str:
+    """Handler da tool get_weather: aceita day_offset ou um texto como "amanha"."""
+    if day_offset is None:
+        day_offset = parse_day(text)
+    try:
+        day_offset = int(day_offset)
+    except (TypeError, ValueError):
+        day_offset = 1
+    return get_weather(city, day_offset)
+
+
+def parse_day(text):
+
+    text = (text or "").lower()
+
+    if "depois de amanhã" in text or "depois de amanha" in text:
+        return 2
+
+    if "amanhã" in text or "amanha" in text:
+        return 1
+
+    if "hoje" in text:
+        return 0
+
+    if "sábado" in text or "sabado" in text:
+        return 3
+
+    if "domingo" in text:
+        return 4
+
+    return 0
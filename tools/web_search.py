@@ -1,18 +1,121 @@
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
 from duckduckgo_search import DDGS
 
+from config import SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL, SEARCH_RESULT_TOKENS
+from llm.tokens import estimate_tokens, truncate_to_tokens
+from net import clients
+from net.breaker import get_breaker
+
+_local = threading.local()
+_breaker = get_breaker("search")
+
+# Pesquisas recentes ja formatadas: consulta normalizada -> (texto, expira em)
+_cache = OrderedDict()
+# Pesquisas em curso: pedidos iguais esperam pelo mesmo resultado
+_inflight = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "shared": 0}
+
+NO_RESULTS = "Não encontrei resultados relevantes."
+
+
+def _get_ddgs() -> DDGS:
+    """Reutiliza um cliente DDGS por thread, mantendo as ligacoes abertas."""
+    ddgs = getattr(_local, "ddgs", None)
+    if ddgs is None:
+        ddgs = DDGS(timeout=clients.backend_config("search")["read_timeout"])
+        _local.ddgs = ddgs
+    return ddgs
+
+
+def normalize_query(query: str) -> str:
+    """Minusculas, sem acentos e sem espacos repetidos."""
+    normalized = unicodedata.normalize("NFD", (query or "").lower())
+    without_accents = "".join(ch for ch in normalized if unicodedata.category(ch) != "Mn")
+    return " ".join(without_accents.split())
+
+
+def format_results(results: list, max_tokens: int = SEARCH_RESULT_TOKENS) -> str:
+    """Formata os resultados para o LLM, cortando os resumos para caber em max_tokens."""
+    if not results:
+        return NO_RESULTS
+
+    # O titulo e a fonte ficam inteiros; o que sobra do orcamento e
+    # repartido pelos resumos.
+    headers = [
+        (f"Título: {r.get('title', '')}", f"Fonte: {r.get('href', '')}") for r in results
+    ]
+    header_tokens = sum(estimate_tokens(f"{title}\nResumo: \n{href}\n\n") for title, href in headers)
+    body_tokens = max((max_tokens - header_tokens) // len(results) - estimate_tokens("..."), 16)
 
-def search_web(query: str) -> str:
     snippets = []
+    for r, (title, href) in zip(results, headers):
+        body = truncate_to_tokens(r.get("body", ""), body_tokens)
+        snippets.append(f"{title}\nResumo: {body}\n{href}")
+
+    return "\n\n".join(snippets)
+
+
+def _search(query: str) -> str:
+    with _breaker.guard(), clients.track("search"):
+        results = _get_ddgs().text(query, max_results=5)
+
+    return format_results(results or [])
+
+
+def search_web(query: str) -> str:
+    """
+    Pesquisa na web, com cache por consulta normalizada.
+
+    Pedidos iguais em simultaneo fazem uma unica pesquisa e partilham o
+    resultado; os seguintes sao servidos da cache durante SEARCH_CACHE_TTL.
+    """
+    key = normalize_query(query)
+    now = time.time()
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and now < cached[1]:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return cached[0]
+
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+            _stats["misses"] += 1
+        else:
+            _stats["shared"] += 1
+
+    if not leader:
+        return future.result()
+
+    try:
+        text = _search(query)
+    except BaseException as exc:
+        with _lock:
+            _inflight.pop(key, None)
+        future.set_exception(exc)
+        raise
+
+    with _lock:
+        _inflight.pop(key, None)
+        _cache[key] = (text, time.time() + SEARCH_CACHE_TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > SEARCH_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
 
-    with DDGS() as ddgs:
-        results = ddgs.text(query, max_results=5)
-        for r in results:
-            title = r.get("title", "")
-            body = r.get("body", "")
-            href = r.get("href", "")
-            snippets.append(f"Título: {title}\nResumo: {body}\nFonte: {href}")
+    future.set_result(text)
+    return text
 
-    if not snippets:
-        return "Não encontrei resultados relevantes."
 
-    return "\n\n".join(snippets)
\ No newline at end of file
+def search_cache_stats() -> dict:
+    with _lock:
+        return dict(_stats, entries=len(_cache), in_flight=len(_inflight))